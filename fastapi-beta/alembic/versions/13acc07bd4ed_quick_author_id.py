@@ -0,0 +1,67 @@
+"""quick author id
+
+Revision ID: 13acc07bd4ed
+Revises: b65b722a6e1f
+Create Date: 2026-10-17 15:08:44.310829
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '13acc07bd4ed'
+down_revision = 'b65b722a6e1f'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    postgresql = bind.dialect.name == 'postgresql'
+    if postgresql:
+        op.add_column('Quick', sa.Column('author_id', sa.Integer(), nullable=True))
+        op.create_foreign_key('Quick_author_id_fkey', 'Quick', 'Users', ['author_id'], ['user_id'])
+    else:
+        op.add_column('Quick', sa.Column('author_id', sa.Integer(), sa.ForeignKey('Users.user_id'), nullable=True))
+
+    # Back-fill in quick_id ranges, each committed on its own so no batch holds
+    # its row locks for longer than it takes to update it
+    first, last = bind.execute(sa.text('SELECT MIN(quick_id), MAX(quick_id) FROM "Quick"')).one()
+    with op.get_context().autocommit_block():
+        for start in range(first or 0, (last or -1) + 1, BATCH_SIZE):
+            op.execute(sa.text('''
+                UPDATE "Quick" SET author_id = (
+                    SELECT user_id FROM "Users" WHERE "Users".nick_name = "Quick".by
+                )
+                WHERE quick_id >= :start AND quick_id < :end AND author_id IS NULL
+            ''').bindparams(start=start, end=start + BATCH_SIZE))
+
+        op.create_index('ix_quick_author_created', 'Quick',
+                        ['author_id', sa.text('created_at DESC'), sa.text('quick_id DESC')],
+                        postgresql_concurrently=True)
+        op.create_index('ix_followers_fan_out', 'Followers', ['user_followed_id', 'follower_id'],
+                        postgresql_concurrently=True)
+
+    if postgresql:
+        # Nick names can change now without touching the quicks
+        op.drop_constraint('Quick_by_fkey', 'Quick', type_='foreignkey')
+
+
+def downgrade() -> None:
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    # Authors may have changed their nick name since, bring "by" up to date first
+    op.execute(sa.text('''
+        UPDATE "Quick" SET by = (SELECT nick_name FROM "Users" WHERE "Users".user_id = "Quick".author_id)
+        WHERE author_id IS NOT NULL
+    '''))
+    if postgresql:
+        op.create_foreign_key('Quick_by_fkey', 'Quick', 'Users', ['by'], ['nick_name'])
+    op.drop_index('ix_followers_fan_out', table_name='Followers')
+    op.drop_index('ix_quick_author_created', table_name='Quick')
+    with op.batch_alter_table('Quick') as batch:
+        if postgresql:
+            batch.drop_constraint('Quick_author_id_fkey', type_='foreignkey')
+        batch.drop_column('author_id')
@@ -0,0 +1,29 @@
+"""users id sequence
+
+Revision ID: 4359cebaa289
+Revises: 4f8502ccbb55
+Create Date: 2026-10-17 13:05:52.117460
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4359cebaa289'
+down_revision = '4f8502ccbb55'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Ids used to be picked by signup, move the sequence past the ones already taken
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(sa.text('''
+            SELECT setval(pg_get_serial_sequence('"Users"', 'user_id'), COALESCE(MAX(user_id), 0) + 1, false)
+            FROM "Users"
+        '''))
+
+
+def downgrade() -> None:
+    pass
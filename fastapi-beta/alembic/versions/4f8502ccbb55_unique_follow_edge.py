@@ -0,0 +1,36 @@
+"""unique follow edge
+
+Revision ID: 4f8502ccbb55
+Revises: b88df9da6248
+Create Date: 2026-10-17 12:31:17.962054
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f8502ccbb55'
+down_revision = 'b88df9da6248'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Keep the oldest of any duplicated edge, then recount followers from the edges
+    op.execute(sa.text('''
+        DELETE FROM "Followers"
+        WHERE follow_id NOT IN (
+            SELECT MIN(follow_id) FROM "Followers" GROUP BY follower_id, user_followed_id
+        )
+    '''))
+    op.execute(sa.text('''
+        UPDATE "Users" SET followers = (
+            SELECT COUNT(*) FROM "Followers" WHERE "Followers".user_followed_id = "Users".user_id
+        )
+    '''))
+    op.create_index('ux_followers_edge', 'Followers', ['follower_id', 'user_followed_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ux_followers_edge', table_name='Followers')
@@ -0,0 +1,25 @@
+"""quick created index
+
+Revision ID: 527fef5f176e
+Revises: ec5659bff9d8
+Create Date: 2026-10-17 10:04:55.731902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '527fef5f176e'
+down_revision = 'ec5659bff9d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_quick_created', 'Quick',
+                    [sa.text('created_at DESC'), sa.text('quick_id DESC')])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_quick_created', table_name='Quick')
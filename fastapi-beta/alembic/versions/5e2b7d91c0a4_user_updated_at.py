@@ -0,0 +1,26 @@
+"""user updated at
+
+Revision ID: 5e2b7d91c0a4
+Revises: c3f1a9d27b64
+Create Date: 2026-10-17 18:05:41.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2b7d91c0a4'
+down_revision = 'c3f1a9d27b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Part of the feed ETag, a renamed author changes the feeds that show them
+    op.add_column('Users', sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('Users') as batch:
+        batch.drop_column('updated_at')
@@ -0,0 +1,25 @@
+"""quick updated index
+
+Revision ID: 80d8096c96be
+Revises: 4359cebaa289
+Create Date: 2026-10-17 14:02:18.517204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '80d8096c96be'
+down_revision = '4359cebaa289'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Lets feeds read the latest edit with max(updated_at) for their ETag
+    op.create_index('ix_quick_updated', 'Quick', ['updated_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_quick_updated', table_name='Quick')
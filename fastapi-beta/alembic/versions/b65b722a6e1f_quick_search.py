@@ -0,0 +1,59 @@
+"""quick search
+
+Revision ID: b65b722a6e1f
+Revises: 80d8096c96be
+Create Date: 2026-10-17 14:31:07.902655
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b65b722a6e1f'
+down_revision = '80d8096c96be'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        # Generated column: Postgres keeps it in sync with content on every write
+        op.execute(sa.text('''
+            ALTER TABLE "Quick" ADD COLUMN search_vector tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED
+        '''))
+        op.execute(sa.text('CREATE INDEX ix_quick_search ON "Quick" USING GIN (search_vector)'))
+    else:
+        op.execute(sa.text('''
+            CREATE VIRTUAL TABLE quick_search
+            USING fts5(content, content='Quick', content_rowid='quick_id')
+        '''))
+        op.execute(sa.text('''
+            CREATE TRIGGER quick_search_insert AFTER INSERT ON "Quick" BEGIN
+                INSERT INTO quick_search (rowid, content) VALUES (new.quick_id, new.content);
+            END
+        '''))
+        op.execute(sa.text('''
+            CREATE TRIGGER quick_search_delete AFTER DELETE ON "Quick" BEGIN
+                INSERT INTO quick_search (quick_search, rowid, content) VALUES ('delete', old.quick_id, old.content);
+            END
+        '''))
+        op.execute(sa.text('''
+            CREATE TRIGGER quick_search_update AFTER UPDATE OF content ON "Quick" BEGIN
+                INSERT INTO quick_search (quick_search, rowid, content) VALUES ('delete', old.quick_id, old.content);
+                INSERT INTO quick_search (rowid, content) VALUES (new.quick_id, new.content);
+            END
+        '''))
+        # Index the quicks that already exist
+        op.execute(sa.text("INSERT INTO quick_search (quick_search) VALUES ('rebuild')"))
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_quick_search', table_name='Quick')
+        op.drop_column('Quick', 'search_vector')
+    else:
+        for trigger in ('quick_search_insert', 'quick_search_delete', 'quick_search_update'):
+            op.execute(sa.text(f'DROP TRIGGER {trigger}'))
+        op.execute(sa.text('DROP TABLE quick_search'))
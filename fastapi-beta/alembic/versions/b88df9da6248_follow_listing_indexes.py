@@ -0,0 +1,26 @@
+"""follow listing indexes
+
+Revision ID: b88df9da6248
+Revises: fd550bab1ad9
+Create Date: 2026-10-17 11:52:40.208713
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b88df9da6248'
+down_revision = 'fd550bab1ad9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_followers_follower', 'Followers', ['follower_id', 'follow_id'])
+    op.create_index('ix_followers_followed', 'Followers', ['user_followed_id', 'follow_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_followers_followed', table_name='Followers')
+    op.drop_index('ix_followers_follower', table_name='Followers')
@@ -0,0 +1,105 @@
+"""partition quicks
+
+Revision ID: c3f1a9d27b64
+Revises: 13acc07bd4ed
+Create Date: 2026-10-17 16:42:19.518306
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a9d27b64'
+down_revision = '13acc07bd4ed'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'quick_id, content, created_at, updated_at, "by", author_id'
+# Months after the current one partitioned right away, utils/partitions.py keeps it up
+PARTITIONS_AHEAD = 3
+INDEXES = (
+    'CREATE INDEX ix_quick_created ON "Quick" (created_at DESC, quick_id DESC)',
+    'CREATE INDEX ix_quick_updated ON "Quick" (updated_at)',
+    'CREATE INDEX ix_quick_author_created ON "Quick" (author_id, created_at DESC, quick_id DESC)',
+    'CREATE INDEX ix_quick_search ON "Quick" USING GIN (search_vector)',
+)
+
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def create_quick(partitioned: bool):
+    op.execute(sa.text(f'''
+        CREATE TABLE "Quick" (
+            quick_id INTEGER NOT NULL DEFAULT nextval('"Quick_quick_id_seq"'::regclass),
+            content VARCHAR,
+            created_at TIMESTAMP WITHOUT TIME ZONE{' NOT NULL' if partitioned else ''},
+            updated_at TIMESTAMP WITHOUT TIME ZONE,
+            "by" VARCHAR,
+            author_id INTEGER,
+            search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED,
+            CONSTRAINT "Quick_pkey" PRIMARY KEY ({'quick_id, created_at' if partitioned else 'quick_id'}),
+            CONSTRAINT "Quick_author_id_fkey" FOREIGN KEY (author_id) REFERENCES "Users" (user_id)
+        ){' PARTITION BY RANGE (created_at)' if partitioned else ''}
+    '''))
+
+
+def replace_quick(partitioned: bool):
+    """
+    Rebuild "Quick" as a partitioned or a plain table and copy the rows over,
+    writes to "Quick" must be stopped while it runs
+    """
+    bind = op.get_bind()
+    # Index and constraint names are taken by the old table until it is dropped
+    for index in ('ix_quick_created', 'ix_quick_updated', 'ix_quick_author_created', 'ix_quick_search'):
+        op.execute(sa.text(f'DROP INDEX IF EXISTS {index}'))
+    op.execute(sa.text('ALTER TABLE "Quick" RENAME TO "Quick_old"'))
+    op.execute(sa.text('ALTER TABLE "Quick_old" RENAME CONSTRAINT "Quick_pkey" TO "Quick_old_pkey"'))
+    # Otherwise the sequence goes away with the old table
+    op.execute(sa.text('ALTER SEQUENCE "Quick_quick_id_seq" OWNED BY NONE'))
+    create_quick(partitioned)
+
+    if partitioned:
+        first = bind.execute(sa.text('SELECT MIN(created_at) FROM "Quick_old"')).scalar() or datetime.now()
+        month = datetime(first.year, first.month, 1)
+        last = add_months(datetime.now(), PARTITIONS_AHEAD)
+        op.execute(sa.text('CREATE TABLE "Quick_default" PARTITION OF "Quick" DEFAULT'))
+        while month <= last:
+            op.execute(sa.text(
+                f'''CREATE TABLE "Quick_y{month.year:04d}m{month.month:02d}" PARTITION OF "Quick" '''
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+            ))
+            month = add_months(month, 1)
+        # created_at is part of the primary key now, it can not stay empty
+        copied = COLUMNS.replace('created_at', 'COALESCE(created_at, updated_at, now()::timestamp)')
+    else:
+        copied = COLUMNS
+    op.execute(sa.text(f'INSERT INTO "Quick" ({COLUMNS}) SELECT {copied} FROM "Quick_old"'))
+    op.execute(sa.text('DROP TABLE "Quick_old"'))
+    op.execute(sa.text('ALTER SEQUENCE "Quick_quick_id_seq" OWNED BY "Quick".quick_id'))
+    for statement in INDEXES:
+        op.execute(sa.text(statement))
+    op.execute(sa.text('ANALYZE "Quick"'))
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        # SQLite keeps a single "Quick", utils/partitions.py moves its cold
+        # months out to a table per month
+        return
+    # A partitioned "Quick" has no unique quick_id a foreign key could reference
+    op.drop_constraint('Timeline_quick_id_fkey', 'Timeline', type_='foreignkey')
+    replace_quick(partitioned=True)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # Archived partitions stay where utils/partitions.py left them
+    replace_quick(partitioned=False)
+    op.execute(sa.text('DELETE FROM "Timeline" WHERE quick_id NOT IN (SELECT quick_id FROM "Quick")'))
+    op.create_foreign_key('Timeline_quick_id_fkey', 'Timeline', 'Quick', ['quick_id'], ['quick_id'])
@@ -0,0 +1,51 @@
+"""timeline
+
+Revision ID: ec5659bff9d8
+Revises: 12deea574a19
+Create Date: 2026-10-17 09:12:31.406118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ec5659bff9d8'
+down_revision = '12deea574a19'
+branch_labels = None
+depends_on = None
+
+TIMELINE_MAX_LENGTH = 800
+
+
+def upgrade() -> None:
+    op.create_table('Timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('quick_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['Users.user_id']),
+    sa.ForeignKeyConstraint(['quick_id'], ['Quick.quick_id']),
+    sa.PrimaryKeyConstraint('user_id', 'quick_id')
+    )
+    op.create_index('ix_timeline_user_created', 'Timeline',
+                    ['user_id', sa.text('created_at DESC'), sa.text('quick_id DESC')])
+    # Back-fill every timeline from the existing follow graph
+    op.execute(sa.text(f'''
+        INSERT INTO "Timeline" (user_id, quick_id, created_at)
+        SELECT user_id, quick_id, created_at FROM (
+            SELECT f.follower_id AS user_id, q.quick_id, q.created_at,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY f.follower_id
+                       ORDER BY q.created_at DESC, q.quick_id DESC
+                   ) AS position
+            FROM (SELECT DISTINCT follower_id, user_followed_id FROM "Followers") f
+            JOIN "Users" u ON u.user_id = f.user_followed_id
+            JOIN "Quick" q ON q.by = u.nick_name
+        ) ranked
+        WHERE position <= {TIMELINE_MAX_LENGTH}
+    '''))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_timeline_user_created', table_name='Timeline')
+    op.drop_table('Timeline')
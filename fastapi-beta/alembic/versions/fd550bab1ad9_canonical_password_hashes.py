@@ -0,0 +1,34 @@
+"""canonical password hashes
+
+Revision ID: fd550bab1ad9
+Revises: 527fef5f176e
+Create Date: 2026-10-17 11:20:08.519347
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fd550bab1ad9'
+down_revision = '527fef5f176e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Hashes were stored as '\x<hex>' by psycopg2, decode them to '$2b$...' text.
+    # Other backends keep the old form, it is still read and upgraded on login.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(sa.text(
+            '''UPDATE "Users" SET password = convert_from(decode(substr(password, 3), 'hex'), 'UTF8') '''
+            '''WHERE password LIKE '\\\\x%' '''
+        ))
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(sa.text(
+            '''UPDATE "Users" SET password = '\\x' || encode(convert_to(password, 'UTF8'), 'hex') '''
+            '''WHERE password LIKE '$2%' '''
+        ))
@@ -0,0 +1,63 @@
+"""
+Feed serialization microbenchmark
+
+Renders a feed page of ITEMS quicks the old way (ORM objects run through
+jsonable_encoder, created_at parsed back and reformatted, JSONResponse) and
+the current way (projected rows turned into dicts, ORJSONResponse).
+
+    python -m benchmarks.feed_serialization
+    python -m benchmarks.feed_serialization --items 10000 --repeat 20
+"""
+import argparse
+import timeit
+from collections import namedtuple
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from models.models import Quick as QuickModel
+from utils.serializers import QUICK_COLUMNS, feed_item
+
+
+def make_quicks(items: int):
+    now = datetime.now().replace(microsecond=0)
+    return [
+        QuickModel(quick_id=i, content=f"quick number {i} " * 8, by=f"user{i % 500}",
+                   created_at=now - timedelta(seconds=i), updated_at=now - timedelta(seconds=i))
+        for i in range(items)
+    ]
+
+
+# Stands in for the rows db.execute(select(*QUICK_COLUMNS)) hands back
+QuickRow = namedtuple('QuickRow', [column.key for column in QUICK_COLUMNS])
+
+
+def as_rows(quicks):
+    return [QuickRow(*(getattr(q, key) for key in QuickRow._fields)) for q in quicks]
+
+
+def render_before(quicks) -> bytes:
+    list_quicks = jsonable_encoder(quicks)
+    for obj in list_quicks:
+        obj['created_at'] = datetime.fromisoformat(obj['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+    return JSONResponse(status_code=200, content=list_quicks).body
+
+
+def render_after(rows) -> bytes:
+    return ORJSONResponse(status_code=200, content=[feed_item(row) for row in rows]).body
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare feed serialization paths")
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    quicks = make_quicks(args.items)
+    rows = as_rows(quicks)
+    results = {}
+    for name, func, data in (('before', render_before, quicks), ('after', render_after, rows)):
+        best = min(timeit.repeat(lambda: func(data), number=1, repeat=args.repeat))
+        results[name] = best
+        print(f"{name:>6}: {best * 1000:8.1f} ms per {args.items} items "
+              f"({len(func(data)) / 1024:.0f} KiB)")
+    print(f"speedup: {results['before'] / results['after']:.1f}x")
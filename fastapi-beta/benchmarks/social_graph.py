@@ -0,0 +1,110 @@
+"""
+Synthetic social graph
+
+Seeds the configured database through models.models with users, a follow
+graph whose follower counts follow a power law (a few users followed by
+many, most by few) and quicks whose authors follow the same distribution.
+Timelines are filled the way the timeline migration back-fills them.
+"""
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, update, func, text
+from config.database import engine
+from models.models import User as UserModel
+from models.models import Quick as QuickModel
+from models.models import Followers
+from utils.password_manager import hash_password_sync
+from utils.timeline import TIMELINE_MAX_LENGTH
+
+# Every seeded user logs in with this password
+PASSWORD = 'benchmark-password'
+BATCH_SIZE = 5000
+
+
+def popularity(users: int, alpha: float) -> list:
+    """Zipf weights: the user ranked r is followed and posts in proportion to r ** -alpha"""
+    return [(rank + 1) ** -alpha for rank in range(users)]
+
+
+def follow_edges(user_ids: list, follows: int, alpha: float, rng: random.Random):
+    """Yield (follower_id, user_followed_id) pairs, about `follows` per user"""
+    weights = popularity(len(user_ids), alpha)
+    for follower_id in user_ids:
+        followed = set(rng.choices(user_ids, weights=weights, k=follows))
+        followed.discard(follower_id)
+        for user_followed_id in followed:
+            yield follower_id, user_followed_id
+
+
+def _insert_batches(conn, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            conn.execute(insert(table), batch)
+            batch = []
+    if batch:
+        conn.execute(insert(table), batch)
+
+
+def seed(users: int, follows: int, quicks: int, alpha: float = 1.1, seed_value: int = 0) -> dict:
+    """Fill an empty database, returns how many rows of each kind were written"""
+    rng = random.Random(seed_value)
+    password = hash_password_sync(PASSWORD)
+    now = datetime.now().replace(microsecond=0)
+
+    with engine.begin() as conn:
+        _insert_batches(conn, UserModel, (
+            {
+                'email': f'user{i}@example.com',
+                'nick_name': f'user{i}',
+                'first_name': 'Bench',
+                'last_name': f'User {i}',
+                'birth_date': datetime(1990, 1, 1) + timedelta(days=i % 10000),
+                'password': password,
+                'followers': 0,
+            }
+            for i in range(users)
+        ))
+        rows = conn.execute(select(UserModel.user_id, UserModel.nick_name).order_by(UserModel.user_id)).all()
+        user_ids = [row.user_id for row in rows]
+
+        _insert_batches(conn, Followers, (
+            {'follower_id': follower_id, 'user_followed_id': user_followed_id}
+            for follower_id, user_followed_id in follow_edges(user_ids, follows, alpha, rng)
+        ))
+        counts = (
+            select(func.count())
+            .where(Followers.user_followed_id == UserModel.user_id)
+            .scalar_subquery()
+        )
+        conn.execute(update(UserModel).values(followers=counts))
+
+        weights = popularity(len(rows), alpha)
+        authors = rng.choices(rows, weights=weights, k=quicks)
+        _insert_batches(conn, QuickModel, (
+            {
+                'content': f'Quick {i} by {author.nick_name}',
+                'by': author.nick_name,
+                'author_id': author.user_id,
+                'created_at': now - timedelta(seconds=rng.randrange(30 * 86400)),
+            }
+            for i, author in enumerate(authors)
+        ))
+
+        conn.execute(text(f'''
+            INSERT INTO "Timeline" (user_id, quick_id, created_at)
+            SELECT user_id, quick_id, created_at FROM (
+                SELECT f.follower_id AS user_id, q.quick_id, q.created_at,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY f.follower_id
+                           ORDER BY q.created_at DESC, q.quick_id DESC
+                       ) AS position
+                FROM "Followers" f
+                JOIN "Quick" q ON q.author_id = f.user_followed_id
+            ) ranked
+            WHERE position <= {TIMELINE_MAX_LENGTH}
+        '''))
+        edges = conn.scalar(select(func.count()).select_from(Followers))
+
+    return {'users': len(user_ids), 'follows': edges, 'quicks': quicks}
@@ -1,6 +1,7 @@
 # Python
-import itertools
-import bcrypt
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
 from datetime import date
 from datetime import datetime
 from typing import Optional, List
@@ -13,37 +14,91 @@ from pydantic import Field
 # FastAPI
 from fastapi import FastAPI
 from fastapi import status
-from fastapi import Body, Depends, Header, Path
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
-from fastapi import Request
-
-from utils.jwt_manager import create_token
-from config.database import engine, Base
-from config.database import Session
+from fastapi import Body, Depends, Header, Path, Query
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from fastapi import WebSocket
+from fastapi import HTTPException, Request, Response
+
+# SQLAlchemy
+from sqlalchemy import select, and_, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from utils.jwt_manager import create_token, request_token
+from utils import jwt_manager
+from config.database import CREATE_SCHEMA, create_schema, warm_pool
+from config.database import get_db, pool_status, async_engine, replicas
 from models.models import User as UserModel
 from models.models import Quick as QuickModel
-from middlewares.jwt_bearer import JWTBearer
-from utils.jwt_manager import validate_token
+from middlewares.jwt_bearer import JWTBearer, Principal
+from middlewares.jwt_bearer import get_current_user, resolve_principal, invalidate_principal
+from utils.password_manager import hash_password, verify_password, needs_rehash
 from models.models import Followers
+from models.models import Timeline
+from utils import timeline
+from utils.follows import add_follow, add_follows, remove_follow, list_follows
+from utils.account_deletion import DELETE_BACKGROUND_THRESHOLD, account_size, delete_account
+from utils.account_deletion import start_job as start_deletion_job, wait_for_jobs as wait_for_deletion_jobs
+from utils.account_deletion import jobs as deletion_jobs, invalidate_account
+from utils import entity_cache
+from utils.entity_cache import cached_response
+from utils.serializers import PUBLIC_USER_COLUMNS, select_quicks
+from utils.serializers import quick_to_dict, feed_item, profile_to_dict
+from utils.etags import make_etag, matches, not_modified
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.pagination import encode_cursor, decode_quick_cursor, decode_search_cursor
+from utils.search import DELETED_CONTENT, search_query
+from middlewares.sql_timing import SQLTimingMiddleware, instrument
+from middlewares.metrics import MetricsMiddleware
+from middlewares.rate_limit import RateLimitMiddleware
+from utils.metrics import registry as metrics_registry
+from utils import stream
+from utils import post_buffer
+from utils import partitions
+from utils.batch import MAX_BATCH_SIZE, parse_list, batch_body, batch_item
 from fastapi.middleware.cors import CORSMiddleware
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup work runs here rather than at import, once per worker and before its first request
+    if CREATE_SCHEMA:
+        await create_schema()
+    await warm_pool()
+    jwt_manager.warm_up()
+    yield
+    await wait_for_deletion_jobs()
+    await post_buffer.buffer.close()
+    # After the buffer, its last batch grows timelines too
+    await timeline.trimmer.close()
+    await stream.hub.stop()
+    await async_engine.dispose()
+    for replica in replicas.engines:
+        await replica.dispose()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
     "https://master--lucent-torrone-6b45b7.netlify.app"
 ]
 
+# Added before CORS so it runs inside it and 429/503 answers still carry the CORS headers
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "ETag"],
 )
 
+for engine in [async_engine, *replicas.engines]:
+    instrument(engine.sync_engine)
+app.add_middleware(SQLTimingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 # Models
 
 class UserBase(BaseModel):
@@ -94,14 +149,21 @@ class Quick(BaseModel):
         min_length=1, 
         max_length=256
     )
-    created_at: datetime = Field(default=datetime.now())
+    created_at: datetime = Field(default_factory=datetime.now)
     by: Optional[str] = Field(default=None)
 
 class UpdateQuick(Quick):
-    updated_at: Optional[datetime] = Field(default=datetime.now())
+    updated_at: Optional[datetime] = Field(default_factory=datetime.now)
+
+class FollowBatch(BaseModel):
+    user_followed_ids: List[int] = Field(..., min_items=1, max_items=MAX_BATCH_SIZE)
+
+class QuickBatch(BaseModel):
+    quicks: List[Quick] = Field(..., min_items=1, max_items=MAX_BATCH_SIZE)
+
+# Taken by routes under /users/, a user with one of them could not be shown by /users/{id}
+RESERVED_NICK_NAMES = {'batch'}
 
- 
-Base.metadata.create_all(bind=engine)
 
 # Path Operations
 
@@ -115,7 +177,7 @@ Base.metadata.create_all(bind=engine)
     summary="Register a User",
     tags=["Users"]
 )
-def signup(user: UserRegister = Body(...)): 
+async def signup(user: UserRegister = Body(...), db = Depends(get_db)): 
     """
         Signup
 
@@ -133,24 +195,21 @@ def signup(user: UserRegister = Body(...)):
             - last_name: str
             - birth_date: str
     """
-    db = Session()
-    new_user = UserModel(**user.dict())
-    hashed_password = bcrypt.hashpw(new_user.password.encode('utf-8'), bcrypt.gensalt())
-    new_user.password = hashed_password
-    user_with_same_email = db.query(UserModel).filter(UserModel.email == user.email).first()
+    if user.nick_name in RESERVED_NICK_NAMES:
+        return ORJSONResponse(status_code=400, content={'message': 'This nick name is reserved'})
+    # user_id is given by the database sequence
+    new_user = UserModel(**user.dict(exclude={'user_id', 'followers'}), followers=0)
+    user_with_same_email = (await db.scalars(select(UserModel).filter(UserModel.email == user.email))).first()
     if user_with_same_email:
-        return JSONResponse(status_code=400, content={'message': 'Email is already in use'})
-    
-    users_ids = db.query(UserModel.user_id).all()
-    new_user.user_id = len(users_ids)
-    user_with_same_id = db.query(UserModel).filter(UserModel.user_id == new_user.user_id).first()
-    while user_with_same_id:
-        new_user.user_id = new_user.user_id + 1
-        user_with_same_id = db.query(UserModel).filter(UserModel.user_id == new_user.user_id).first()
+        return ORJSONResponse(status_code=400, content={'message': 'Email is already in use'})
+    new_user.password = await hash_password(user.password)
 
     db.add(new_user)
-    db.commit()
-    return JSONResponse(status_code=201, content={'message': 'User has been created'})
+    try:
+        await db.commit()
+    except IntegrityError:
+        return ORJSONResponse(status_code=400, content={'message': 'Email or nick name is already in use'})
+    return ORJSONResponse(status_code=201, content={'message': 'User has been created'})
             
 ### Login a user
 @app.post(
@@ -160,18 +219,16 @@ def signup(user: UserRegister = Body(...)):
     summary="Login a User",
     tags=["Users"]
 )
-def login(user: UserLogin): 
-    db = Session()
-    users = db.query(UserModel).filter(UserModel.email == user.email).first()
-    users.birth_date = users.birth_date.strftime('%Y-%m-%d')
-    if users:
-        decoded_password = bytes.fromhex(users.password[2:]).decode('utf-8')
-        user_without_password = users.__dict__
-        user_without_password.pop('password', None)
-        if bcrypt.checkpw(user.password.encode('utf-8'), decoded_password.encode('utf-8')):
-            token: str = create_token(user.dict())            
-            return JSONResponse(status_code=200, content={ 'user': jsonable_encoder(user_without_password), 'token': token })
-    return JSONResponse(status_code=404, content={'message': 'Password incorrect or user does not exist'})
+async def login(user: UserLogin, db = Depends(get_db)): 
+    users = (await db.scalars(select(UserModel).filter(UserModel.email == user.email))).first()
+    if users and await verify_password(user.password, users.password):
+        if needs_rehash(users.password):
+            users.password = await hash_password(user.password)
+            await db.commit()
+        user_without_password = profile_to_dict(users)
+        token: str = create_token(user.dict())            
+        return ORJSONResponse(status_code=200, content={ 'user': user_without_password, 'token': token })
+    return ORJSONResponse(status_code=404, content={'message': 'Password incorrect or user does not exist'})
 
 '''def login(user: UserLogin): 
     db = Session()
@@ -179,9 +236,9 @@ def login(user: UserLogin):
     decoded_password = bytes.fromhex(users.password[2:]).decode('utf-8')
     if bcrypt.checkpw(user.password.encode('utf-8'), decoded_password):
         token: str = create_token(user.dict())
-        return JSONResponse(status_code=200, content=token)
+        return ORJSONResponse(status_code=200, content=token)
     else:
-        return JSONResponse(status_code=404, content={'message': 'Password incorrect or user does not exist'})'''
+        return ORJSONResponse(status_code=404, content={'message': 'Password incorrect or user does not exist'})'''
 
 ### Follow a user
 @app.post(
@@ -191,27 +248,68 @@ def login(user: UserLogin):
     summary="Follow a user",
     tags=["Users"]
 )
-def follow_user(follow: UserBaseFollow = Body(...), auth: str = Header(...)):
-    db = Session()
-    new_follow = Followers(**follow.dict())
-    user_to_follow_id = db.query(UserModel).filter(UserModel.user_id == new_follow.user_followed_id).first()
-    if user_to_follow_id:
-        data = validate_token(auth)
-        user_follower = db.query(UserModel).filter(UserModel.email == data['email']).first()
-        new_follow.follower_id = user_follower.user_id
-        already_follow = db.query(Followers).filter(Followers.follower_id == user_follower.user_id)
-        for object in already_follow:
-            if object.user_followed_id == new_follow.user_followed_id:
-                return JSONResponse(status_code=400, content={'message': 'You already follow this user'})
-            
-        if new_follow.follower_id == new_follow.user_followed_id:
-                return JSONResponse(status_code=400, content={'message': 'You can not follow yourself'})                   
-        user_to_follow_id.followers += 1
-        db.add(new_follow)
-        db.commit()        
-        return JSONResponse(status_code=200, content={'message': 'You followed'})
+async def follow_user(follow: UserBaseFollow = Body(...), current_user: Principal = Depends(get_current_user), db = Depends(get_db)):
+    nick_name = await db.scalar(select(UserModel.nick_name).filter(UserModel.user_id == follow.user_followed_id))
+    if nick_name:
+        if current_user.user_id == follow.user_followed_id:
+            return ORJSONResponse(status_code=400, content={'message': 'You can not follow yourself'})
+        if not await add_follow(db, current_user.user_id, follow.user_followed_id):
+            return ORJSONResponse(status_code=400, content={'message': 'You already follow this user'})
+        await timeline.backfill(db, current_user.user_id, [follow.user_followed_id])
+        await db.commit()        
+        await entity_cache.profiles.invalidate(nick_name)
+        await stream.hub.followed(current_user.user_id, follow.user_followed_id)
+        return ORJSONResponse(status_code=200, content={'message': 'You followed'})
     else:
-        return JSONResponse(status_code=404, content={'message': 'User Not Found!'})
+        return ORJSONResponse(status_code=404, content={'message': 'User Not Found!'})
+
+### Follow many users
+@app.post(
+    path="/follow/batch",
+    status_code=status.HTTP_200_OK,
+    summary="Follow many users",
+    tags=["Users"]
+)
+async def follow_many_users(follows: FollowBatch = Body(...), current_user: Principal = Depends(get_current_user), db = Depends(get_db)):
+    """
+        Follow many users
+
+        This path operation follows up to MAX_BATCH_SIZE users in one transaction
+
+        Parameters:
+            - Request body parameter
+                - follows: FollowBatch, the user_followed_ids to follow
+
+        Returns a json list with one result per user, in the order they were sent:
+            user_followed_id: int
+            status: int, 200 when followed, 400 or 404 as /follow would answer
+            message: str
+    """
+    user_followed_ids = list(dict.fromkeys(follows.user_followed_ids))
+    nick_names = dict((await db.execute(
+        select(UserModel.user_id, UserModel.nick_name).filter(UserModel.user_id.in_(user_followed_ids))
+    )).all())
+    candidates = [user_id for user_id in user_followed_ids if user_id in nick_names and user_id != current_user.user_id]
+    followed = await add_follows(db, current_user.user_id, candidates) if candidates else set()
+    if followed:
+        await timeline.backfill(db, current_user.user_id, list(followed))
+    await db.commit()
+    await entity_cache.profiles.invalidate(*[nick_names[user_id] for user_id in followed])
+    for user_id in followed:
+        await stream.hub.followed(current_user.user_id, user_id)
+
+    results = []
+    for user_id in user_followed_ids:
+        if user_id not in nick_names:
+            result = (404, 'User Not Found!')
+        elif user_id == current_user.user_id:
+            result = (400, 'You can not follow yourself')
+        elif user_id not in followed:
+            result = (400, 'You already follow this user')
+        else:
+            result = (200, 'You followed')
+        results.append({'user_followed_id': user_id, 'status': result[0], 'message': result[1]})
+    return ORJSONResponse(status_code=200, content=results)
 
 ### Unfollow a user
 @app.post(
@@ -221,24 +319,18 @@ def follow_user(follow: UserBaseFollow = Body(...), auth: str = Header(...)):
     summary="Unfollow a user",
     tags=["Users"]
 )
-def unfollow_user(unfollow: UserBaseFollow = Body(...), auth: str = Header(...)):
-    db = Session()
-    follow = Followers(**unfollow.dict())
-    user_to_unfollow = db.query(UserModel).filter(UserModel.user_id == follow.user_followed_id).first()
-    if user_to_unfollow:
-        data = validate_token(auth)
-        user_follower = db.query(UserModel).filter(UserModel.email == data['email']).first()
-        followed_list = db.query(Followers).filter(Followers.follower_id == user_follower.user_id).all()
-        for object in followed_list:
-            if object.user_followed_id == follow.user_followed_id:
-                db.delete(object)
-                user_to_unfollow.followers -= 1
-                db.commit()
-                return JSONResponse(status_code=200, content={'message': 'You unfollowed'})          
-                
-        return JSONResponse(status_code=404, content={'message': 'You are not following this user'})
+async def unfollow_user(unfollow: UserBaseFollow = Body(...), current_user: Principal = Depends(get_current_user), db = Depends(get_db)):
+    nick_name = await db.scalar(select(UserModel.nick_name).filter(UserModel.user_id == unfollow.user_followed_id))
+    if nick_name:
+        if not await remove_follow(db, current_user.user_id, unfollow.user_followed_id):
+            return ORJSONResponse(status_code=404, content={'message': 'You are not following this user'})
+        await timeline.remove_author(db, current_user.user_id, unfollow.user_followed_id)
+        await db.commit()
+        await entity_cache.profiles.invalidate(nick_name)
+        await stream.hub.unfollowed(current_user.user_id, unfollow.user_followed_id)
+        return ORJSONResponse(status_code=200, content={'message': 'You unfollowed'})
     else:
-        return JSONResponse(status_code=404, content={'message': 'User Not Found!'})
+        return ORJSONResponse(status_code=404, content={'message': 'User Not Found!'})
 
 ### Show all followed
 @app.get(
@@ -248,27 +340,17 @@ def unfollow_user(unfollow: UserBaseFollow = Body(...), auth: str = Header(...))
     summary="Show all users i follow",
     tags=["Users"]
 )
-def show_followed(auth: str = Header(...)):
-    db = Session()
-    data = validate_token(auth)
-    current_user = db.query(UserModel).filter(UserModel.email == data['email']).first()
-    my_followed = db.query(Followers).filter(Followers.follower_id == current_user.user_id).all()
-    users_followers = [None] * len(my_followed)
-    for i, object in enumerate(my_followed):
-        users_followers[i] = db.query(UserModel).filter(UserModel.user_id == object.user_followed_id).first()
-
-    exclude_pass = [None] * len(users_followers)
-
-    for i in range(len(users_followers)):
-        exclude_pass[i] = User(nick_name='nick_name', first_name='first_name', last_name='last_name')
-        exclude_pass[i].user_id = users_followers[i].user_id
-        exclude_pass[i].email = users_followers[i].email
-        exclude_pass[i].nick_name = users_followers[i].nick_name
-        exclude_pass[i].first_name = users_followers[i].first_name
-        exclude_pass[i].last_name = users_followers[i].last_name
-        exclude_pass[i].birth_date = users_followers[i].birth_date
-        exclude_pass[i].followers = users_followers[i].followers
-    return JSONResponse(status_code=200, content=jsonable_encoder(exclude_pass))
+async def show_followed(
+    current_user: Principal = Depends(get_current_user),
+    after: Optional[str] = Query(default=None),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db = Depends(get_db)
+):
+    users, next_cursor = await list_follows(
+        db, Followers.user_followed_id, Followers.follower_id, current_user.user_id, after, limit
+    )
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+    return ORJSONResponse(status_code=200, content=users, headers=headers)
 
 ### Show all followers
 @app.get(
@@ -278,12 +360,19 @@ def show_followed(auth: str = Header(...)):
     summary="Show my followers",
     tags=["Users"]
 )
-def show_my_followers(auth: str = Header(...)): 
+async def show_my_followers(
+    current_user: Principal = Depends(get_current_user),
+    after: Optional[str] = Query(default=None),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db = Depends(get_db)
+): 
     """
     This path operation shows all your followers in the app
 
     Parameters: 
-        -
+        - Query parameters
+            - after: str (cursor from the X-Next-Cursor header of the previous page)
+            - limit: int
 
     Returns a json list with all users in the app, with the following keys: 
         - user_id: int
@@ -294,26 +383,47 @@ def show_my_followers(auth: str = Header(...)):
         - birth_date: datetime
         - followers
     """
-    db = Session()
-    data = validate_token(auth)
-    current_user = db.query(UserModel).filter(UserModel.email == data['email']).first()
-    my_followers = db.query(Followers).filter(Followers.user_followed_id == current_user.user_id).all()
-    users_followers = [None] * len(my_followers)
-    for i, object in enumerate(my_followers):
-        users_followers[i] = db.query(UserModel).filter(UserModel.user_id == object.follower_id).first()
-
-    exclude_pass = [None] * len(users_followers)
-
-    for i in range(len(users_followers)):
-        exclude_pass[i] = User(nick_name='nick_name', first_name='first_name', last_name='last_name')
-        exclude_pass[i].user_id = users_followers[i].user_id
-        exclude_pass[i].email = users_followers[i].email
-        exclude_pass[i].nick_name = users_followers[i].nick_name
-        exclude_pass[i].first_name = users_followers[i].first_name
-        exclude_pass[i].last_name = users_followers[i].last_name
-        exclude_pass[i].birth_date = users_followers[i].birth_date
-        exclude_pass[i].followers = users_followers[i].followers
-    return JSONResponse(status_code=200, content=jsonable_encoder(exclude_pass))
+    users, next_cursor = await list_follows(
+        db, Followers.follower_id, Followers.user_followed_id, current_user.user_id, after, limit
+    )
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+    return ORJSONResponse(status_code=200, content=users, headers=headers)
+
+### Show many users
+@app.get(
+    path="/users/batch",
+    status_code=status.HTTP_200_OK,
+    summary="Show many users",
+    tags=["Users"]
+)
+async def show_many_users(nicks: str = Query(...), db = Depends(get_db)):
+    """
+        Show many users
+
+        This path operation shows up to MAX_BATCH_SIZE users with one query
+
+        Parameters:
+            - Query parameter
+                - nicks: str, comma separated nick names
+
+        Returns a json list with one result per nick name, in the order they were sent:
+            nick_name: str
+            status: int, 200 or 404
+            user: the user as /users/{id} returns it, when found
+    """
+    nick_names = parse_list(nicks)
+
+    async def load(missing):
+        users = (await db.execute(select(*PUBLIC_USER_COLUMNS).filter(UserModel.nick_name.in_(missing)))).all()
+        return {user.nick_name: cached_response(make_etag(*user), profile_to_dict(user)) for user in users}
+
+    users = await entity_cache.profiles.get_many(nick_names, load)
+    items = [
+        batch_item({'nick_name': nick_name, 'status': 200}, 'user', users[nick_name].body) if users[nick_name]
+        else batch_item({'nick_name': nick_name, 'status': 404, 'message': "User not found!"})
+        for nick_name in nick_names
+    ]
+    return Response(batch_body(items), status_code=200, media_type='application/json')
 
 ### Show a user
 @app.get(
@@ -323,21 +433,24 @@ def show_my_followers(auth: str = Header(...)):
     summary="Show a User",
     tags=["Users"]
 )
-def show_a_user(id: str = Path()): 
-    db = Session()
-    user = db.query(UserModel).filter(UserModel.nick_name == id).first()
+async def show_a_user(
+    id: str = Path(),
+    if_none_match: Optional[str] = Header(default=None),
+    db = Depends(get_db)
+): 
+    async def load():
+        user = (await db.execute(select(*PUBLIC_USER_COLUMNS).filter(UserModel.nick_name == id))).first()
+        if user:
+            return cached_response(make_etag(*user), profile_to_dict(user))
+
+    user = await entity_cache.profiles.get_or_load(id, load)
     if user:
-        user_with_out_password = User(nick_name='nick_name', first_name='first_name', last_name='last_name')
-        user_with_out_password.email = user.email
-        user_with_out_password.user_id = user.user_id
-        user_with_out_password.nick_name = user.nick_name
-        user_with_out_password.birth_date = user.birth_date.strftime('%Y-%m-%d')
-        user_with_out_password.first_name = user.first_name
-        user_with_out_password.last_name = user.last_name
-        user_with_out_password.followers = user.followers
-        return JSONResponse(status_code=200, content=jsonable_encoder(user_with_out_password))
+        headers = {'ETag': user.etag, 'Cache-Control': 'no-cache'}
+        if matches(if_none_match, user.etag):
+            return not_modified(user.etag, headers)
+        return Response(user.body, status_code=200, media_type='application/json', headers=headers)
     else:
-        return JSONResponse(status_code=404, content={'message': "User not found!"})
+        return ORJSONResponse(status_code=404, content={'message': "User not found!"})
 
 ### Delete a user
 @app.delete(
@@ -347,25 +460,41 @@ def show_a_user(id: str = Path()):
     summary="Delete a User",
     tags=["Users"]
 )
-def delete_a_user(auth: str = Header(...)): 
-    db = Session()
-    data = validate_token(auth)
-    current_user = db.query(UserModel).filter(UserModel.email == data['email']).first()
-    quicks_user = db.query(QuickModel).filter(QuickModel.by == current_user.nick_name).all()
-    for quick in quicks_user:
-        db.delete(quick)
-    followed_users = db.query(Followers).filter(Followers.follower_id == current_user.user_id).all()
-    for follow in followed_users:
-        user = db.query(UserModel).filter(UserModel.user_id == follow.user_followed_id).first()
-        user.followers -= 1
-        db.delete(follow)
-    users_following_me = db.query(Followers).filter(Followers.user_followed_id == current_user.user_id).all()
-    for follow in users_following_me:
-        db.delete(follow)
-
-    db.delete(current_user)
-    db.commit()
-    return JSONResponse(status_code=200, content={'message': 'User deleted'})
+async def delete_a_user(
+    current_user: Principal = Depends(get_current_user),
+    db = Depends(get_db)
+): 
+    """
+    This path operation deletes your account, your quicks and follows
+
+    Large accounts are deleted in the background: the response is a 202 with
+    a job_id whose progress is shown by GET /users/delete/{job_id}, on the
+    worker that answered this request
+    """
+    if await account_size(db, current_user.user_id) > DELETE_BACKGROUND_THRESHOLD:
+        job_id = start_deletion_job(current_user.user_id, current_user.nick_name)
+        return ORJSONResponse(status_code=202, content={'message': 'User deletion started', 'job_id': job_id})
+
+    quick_ids, followed_nick_names = await delete_account(db, current_user.user_id, current_user.nick_name)
+    await db.commit()
+    # After the commit, a request resolving the token before it would cache the user again
+    invalidate_principal(current_user.user_id)
+    await invalidate_account(current_user.nick_name, quick_ids, followed_nick_names)
+    return ORJSONResponse(status_code=200, content={'message': 'User deleted'})
+
+### Show a user deletion
+@app.get(
+    path="/users/delete/{job_id}",
+    status_code=status.HTTP_200_OK,
+    summary="Show the progress of a user deletion",
+    tags=["Users"]
+)
+async def show_user_deletion(job_id: str = Path()):
+    job = deletion_jobs.get(job_id)
+    if job:
+        return ORJSONResponse(status_code=200, content=job)
+    else:
+        return ORJSONResponse(status_code=404, content={'message': 'Deletion job not found'})
 
 ### Update a user
 @app.put(
@@ -375,18 +504,27 @@ def delete_a_user(auth: str = Header(...)):
     summary="Update a User",
     tags=["Users"]
 )
-def update_a_user(new_data: UserRegister = Body(...), auth: str = Header(...)):
-        db = Session()
-        data = validate_token(auth)
-        current_user = db.query(UserModel).filter(UserModel.email == data['email']).first()
-        current_user.email = new_data.email
-        current_user.nick_name = new_data.nick_name
-        current_user.first_name = new_data.first_name
-        current_user.last_name = new_data.last_name
-        current_user.birth_date = new_data.birth_date
-        current_user.password = bcrypt.hashpw(new_data.password.encode('utf-8'), bcrypt.gensalt())
-        db.commit()
-        return JSONResponse(status_code=200, content={'message': 'Updated'})
+async def update_a_user(new_data: UserRegister = Body(...), current_user: Principal = Depends(get_current_user), db = Depends(get_db)):
+        if new_data.nick_name in RESERVED_NICK_NAMES and new_data.nick_name != current_user.nick_name:
+            return ORJSONResponse(status_code=400, content={'message': 'This nick name is reserved'})
+        hashed_password = await hash_password(new_data.password)
+        user = await db.get(UserModel, current_user.user_id)
+        if user is None:
+            return ORJSONResponse(status_code=404, content={'message': 'User not found!'})
+        user.email = new_data.email
+        user.nick_name = new_data.nick_name
+        user.first_name = new_data.first_name
+        user.last_name = new_data.last_name
+        user.birth_date = new_data.birth_date
+        user.password = hashed_password
+        user.updated_at = datetime.now()
+        await db.commit()
+        invalidate_principal(current_user.user_id)
+        await entity_cache.profiles.invalidate(current_user.nick_name, new_data.nick_name)
+        if new_data.nick_name != current_user.nick_name:
+            # Cached quicks carry the nick name of their author
+            await entity_cache.quicks.bump(current_user.user_id)
+        return ORJSONResponse(status_code=200, content={'message': 'Updated'})
 
 ## Quicks
 
@@ -398,14 +536,25 @@ def update_a_user(new_data: UserRegister = Body(...), auth: str = Header(...)):
     summary="Show all quicks",
     tags=["Quicks"]
 )
-async def home(auth: str = Header(default='0')):
+async def home(
+    auth: str = Header(default='0'),
+    before: Optional[str] = Query(default=None),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    if_none_match: Optional[str] = Header(default=None),
+    db = Depends(get_db)
+):
     """
     This path operation shows all quicks of users you follow
 
+    Responses carry an ETag, a request with a matching If-None-Match
+    header gets an empty 304 instead
+
     Parameters: 
-        -
+        - Query parameters
+            - before: str (cursor from the X-Next-Cursor header of the previous page)
+            - limit: int
 
-    Returns a json list with all quicks in the app: 
+    Returns a json list with all quicks in the app, newest first: 
             quick_id: int  
             content: str    
             created_at: datetime
@@ -413,46 +562,82 @@ async def home(auth: str = Header(default='0')):
             by: User (nick_name)
     """
     try:
-        data = validate_token(auth)
-    except:
-        data = None
-    if not data:
-        db = Session()
-        quicks = db.query(QuickModel).all()
-        list_quicks = jsonable_encoder(quicks)        
-        for obj in list_quicks:
-            obj['created_at'] = datetime.fromisoformat(obj['created_at'].replace('Z', '+00:00'))
-        reversed_quicks = sorted(list_quicks, key=lambda x:-x['created_at'].timestamp())
-        for obj in reversed_quicks:
-            obj['created_at'] = obj['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-        
-        return JSONResponse(status_code=200, content=reversed_quicks)
-            
-    db = Session()
-    current_user = db.query(UserModel).filter(UserModel.email == data['email']).first()
-    follows = db.query(Followers).filter(Followers.follower_id == current_user.user_id).all()
-    users_i_follow = [None] * len(follows)
-    for i, follow in enumerate(follows):
-        users_i_follow[i] = db.query(UserModel).filter(UserModel.user_id == follow.user_followed_id).first()
-        
-    quicks = [None] * len(users_i_follow)
-    count = 0
-    for user in users_i_follow:
-        quicks[count] = db.query(QuickModel).filter(QuickModel.by == user.nick_name).all()
-        list_quicks = jsonable_encoder(quicks[count])
-        if len(list_quicks) != 0:
-            count += 1
-
-    quicks_iterable = jsonable_encoder(quicks)
-    quicks_sin_none = [lista for lista in quicks_iterable if lista is not None]
-    quicks_list = list(itertools.chain.from_iterable(quicks_sin_none))
-    for obj in quicks_list:
-        obj['created_at'] = datetime.fromisoformat(obj['created_at'].replace('Z', '+00:00'))
-    sorted_list = sorted(quicks_list, key=lambda x:-x['created_at'].timestamp())
-    for obj in sorted_list:
-        obj['created_at'] = obj['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-
-    return JSONResponse(status_code=200, content=sorted_list)
+        current_user = await resolve_principal(auth, db)
+    except HTTPException:
+        current_user = None
+    headers = {'Cache-Control': 'no-cache', 'Vary': 'auth'}
+    # Older quicks are archived, bounding created_at lets Postgres skip their partitions
+    horizon = partitions.feed_horizon()
+    if not current_user:
+        sort_keys = (QuickModel.created_at, QuickModel.quick_id)
+        query = select_quicks()
+    else:
+        # Known before running the feed query, so repeat polls skip it
+        headers['ETag'] = make_etag(current_user.user_id, before, limit, horizon, *await timeline.version(db, current_user.user_id))
+        if matches(if_none_match, headers['ETag']):
+            return not_modified(headers['ETag'], headers)
+        sort_keys = (Timeline.created_at, Timeline.quick_id)
+        query = (
+            select_quicks()
+            # created_at as well, so each quick is looked up in its own partition only
+            .join(Timeline, and_(Timeline.quick_id == QuickModel.quick_id, Timeline.created_at == QuickModel.created_at))
+            .filter(Timeline.user_id == current_user.user_id)
+        )
+        if horizon:
+            query = query.filter(Timeline.created_at >= horizon)
+    if horizon:
+        query = query.filter(QuickModel.created_at >= horizon)
+    if before:
+        query = query.filter(tuple_(*sort_keys) < decode_quick_cursor(before))
+    quicks = (await db.execute(query.order_by(*[key.desc() for key in sort_keys]).limit(limit))).all()
+
+    if len(quicks) == limit:
+        headers['X-Next-Cursor'] = encode_cursor(quicks[-1].created_at, quicks[-1].quick_id)
+    if not current_user:
+        headers['ETag'] = make_etag(*quicks)
+        if matches(if_none_match, headers['ETag']):
+            return not_modified(headers['ETag'], headers)
+    list_quicks = [feed_item(row) for row in quicks]
+
+    return ORJSONResponse(status_code=200, content=list_quicks, headers=headers)
+
+## Search quicks
+@app.get(
+    path="/search",
+    response_model=List[Quick],
+    status_code=status.HTTP_200_OK,
+    summary="Search quicks",
+    tags=["Quicks"]
+)
+async def search(
+    q: str = Query(..., min_length=1, max_length=256),
+    after: Optional[str] = Query(default=None),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db = Depends(get_db)
+):
+    """
+    This path operation searches the content of all quicks
+
+    Parameters: 
+        - Query parameters
+            - q: str (words to look for)
+            - after: str (cursor from the X-Next-Cursor header of the previous page)
+            - limit: int
+
+    Returns a json list with the matching quicks, best match first: 
+            quick_id: int  
+            content: str    
+            created_at: datetime
+            updated_at: Optional[datetime]
+            by: User (nick_name)
+    """
+    query = search_query(db.bind.dialect.name, q, decode_search_cursor(after) if after else None, limit)
+    quicks = (await db.execute(query)).all() if query is not None else []
+
+    headers = {}
+    if len(quicks) == limit:
+        headers['X-Next-Cursor'] = encode_cursor(quicks[-1].score, quicks[-1].quick_id)
+    return ORJSONResponse(status_code=200, content=[feed_item(row) for row in quicks], headers=headers)
 
         
 ## Post a quick
@@ -464,7 +649,7 @@ async def home(auth: str = Header(default='0')):
     tags=["Quicks"],
     dependencies=[Depends(JWTBearer())]
 )
-def post(request: Request, quick: Quick = Body(...)):
+async def post(request: Request, quick: Quick = Body(...), db = Depends(get_db)):
     """
         Post a quick
 
@@ -481,19 +666,103 @@ def post(request: Request, quick: Quick = Body(...)):
             updated_at: Optional[datetime]
             by: User
     """
-    db = Session()
-    data = request.state.current_user
-    if data:
-        user = db.query(UserModel).filter(UserModel.email == data['email']).first()
-        quick.by = user.nick_name
-        new_quick = QuickModel(**quick.dict()) 
+    current_user = request.state.current_user
+    if current_user:
+        quick.by = current_user.nick_name
+        if post_buffer.POST_BUFFER_ENABLED:
+            # The connection goes back to the pool while the quick waits for its batch
+            await db.close()
+            row = await post_buffer.buffer.submit(
+                dict(quick.dict(), author_id=current_user.user_id, updated_at=None), request_token(request.headers)
+            )
+            await stream.hub.publish_quick(current_user.user_id, feed_item(SimpleNamespace(**row)))
+            return ORJSONResponse(status_code=201, content={"message": "You quicked"})
+        new_quick = QuickModel(**quick.dict(), author_id=current_user.user_id)
         db.add(new_quick)
-        db.commit()
-        return JSONResponse(status_code=201, content={"message": "You quicked"})
+        await db.flush()
+        await timeline.fan_out_quick(db, new_quick, current_user.user_id)
+        await db.commit()
+        await stream.hub.publish_quick(current_user.user_id, feed_item(new_quick))
+        return ORJSONResponse(status_code=201, content={"message": "You quicked"})
     else:
-        return JSONResponse(status_code=400, content={'message': 'You need to log in'})
+        return ORJSONResponse(status_code=400, content={'message': 'You need to log in'})
     
 
+## Post many quicks
+@app.post(
+    path="/post/batch",
+    status_code=status.HTTP_201_CREATED,
+    summary="Post many quicks",
+    tags=["Quicks"],
+    dependencies=[Depends(JWTBearer())]
+)
+async def post_many(request: Request, batch: QuickBatch = Body(...), db = Depends(get_db)):
+    """
+        Post many quicks
+
+        This path operation posts up to MAX_BATCH_SIZE quicks in one transaction
+
+        Parameters:
+            - Request body parameter
+                - batch: QuickBatch, the quicks to post
+
+        Returns a json list with one result per quick, in the order they were sent:
+            quick_id: int
+            status: int, 201
+    """
+    current_user = request.state.current_user
+    if not current_user:
+        return ORJSONResponse(status_code=400, content={'message': 'You need to log in'})
+    rows = [
+        dict(quick.dict(), by=current_user.nick_name, author_id=current_user.user_id, updated_at=None)
+        for quick in batch.quicks
+    ]
+    quick_ids = await post_buffer.insert_quicks(db, rows)
+    await db.commit()
+    for row, quick_id in zip(rows, quick_ids):
+        await stream.hub.publish_quick(current_user.user_id, feed_item(SimpleNamespace(**row, quick_id=quick_id)))
+    return ORJSONResponse(status_code=201, content=[{'quick_id': quick_id, 'status': 201} for quick_id in quick_ids])
+
+
+### Show many quicks
+@app.get(
+    path="/quicks/batch",
+    status_code=status.HTTP_200_OK,
+    summary="Show many quicks",
+    tags=["Quicks"]
+)
+async def show_many_quicks(ids: str = Query(...), db = Depends(get_db)):
+    """
+        Show many quicks
+
+        This path operation shows up to MAX_BATCH_SIZE quicks with one query
+
+        Parameters:
+            - Query parameter
+                - ids: str, comma separated quick ids
+
+        Returns a json list with one result per id, in the order they were sent:
+            quick_id: int
+            status: int, 200 or 404
+            quick: the quick as /quicks/{id} returns it, when found
+    """
+    quick_ids = parse_list(ids, int)
+
+    async def load(missing):
+        quicks = (await db.execute(select_quicks(QuickModel.author_id).filter(QuickModel.quick_id.in_(missing)))).all()
+        return {
+            quick.quick_id: cached_response(make_etag(*quick), quick_to_dict(quick), quick.author_id)
+            for quick in quicks
+        }
+
+    quicks = await entity_cache.quicks.get_many(quick_ids, load)
+    items = [
+        batch_item({'quick_id': quick_id, 'status': 200}, 'quick', quicks[quick_id].body) if quicks[quick_id]
+        else batch_item({'quick_id': quick_id, 'status': 404, 'message': "Quick not found, may have been deleted"})
+        for quick_id in quick_ids
+    ]
+    return Response(batch_body(items), status_code=200, media_type='application/json')
+
 ### Show a quick
 @app.get(
     path="/quicks/{id}",
@@ -502,13 +771,25 @@ def post(request: Request, quick: Quick = Body(...)):
     summary="Show a quick",
     tags=["Quicks"]
 )
-def show_a_quick(id: int = Path()):
-    db = Session()
-    quick = db.query(QuickModel).filter(QuickModel.quick_id == id).first()
+async def show_a_quick(
+    id: int = Path(),
+    if_none_match: Optional[str] = Header(default=None),
+    db = Depends(get_db)
+):
+    async def load():
+        quick = (await db.execute(select_quicks(QuickModel.author_id).filter(QuickModel.quick_id == id))).first()
+        if quick:
+            # Grouped by author, a rename drops every cached quick of theirs at once
+            return cached_response(make_etag(*quick), quick_to_dict(quick), quick.author_id)
+
+    quick = await entity_cache.quicks.get_or_load(id, load)
     if quick:
-        return JSONResponse(status_code=200, content=jsonable_encoder(quick))
+        headers = {'ETag': quick.etag, 'Cache-Control': 'no-cache'}
+        if matches(if_none_match, quick.etag):
+            return not_modified(quick.etag, headers)
+        return Response(quick.body, status_code=200, media_type='application/json', headers=headers)
     else:
-        return JSONResponse(status_code=404, content={'message': "Quick not found, may have been deleted"})
+        return ORJSONResponse(status_code=404, content={'message': "Quick not found, may have been deleted"})
 
 ### Delete a quick
 @app.put(
@@ -518,21 +799,20 @@ def show_a_quick(id: int = Path()):
     summary="Delete a quick",
     tags=["Quicks"]
 )
-def delete_a_quick(id: int = Path(), auth: str = Header(...)):
-    db = Session()
-    data = validate_token(auth)
-    current_user = db.query(UserModel).filter(UserModel.email == data['email']).first()
-    quick_to_delete = db.query(QuickModel).filter(QuickModel.quick_id  == id).first()
+async def delete_a_quick(id: int = Path(), current_user: Principal = Depends(get_current_user), db = Depends(get_db)):
+    quick_to_delete = await db.get(QuickModel, id)
     if quick_to_delete:           
-        if  current_user.nick_name == quick_to_delete.by:
-            quick_to_delete.content = 'Quick deleted'
+        if current_user.user_id == quick_to_delete.author_id:
+            quick_to_delete.content = DELETED_CONTENT
             quick_to_delete.updated_at = datetime.now()
-            db.commit()
-            return JSONResponse(status_code=200, content={'message': 'Quick Deleted!'})
+            await timeline.touch(db, current_user.user_id)
+            await db.commit()
+            await entity_cache.quicks.invalidate(id)
+            return ORJSONResponse(status_code=200, content={'message': 'Quick Deleted!'})
         else:
-            return JSONResponse(status_code=400, content={'message': 'You can not delete this quick'})
+            return ORJSONResponse(status_code=400, content={'message': 'You can not delete this quick'})
     else:
-        return JSONResponse(status_code=404, content={'message':'Quick not found!'})
+        return ORJSONResponse(status_code=404, content={'message':'Quick not found!'})
 
 ### Update a quick
 @app.put(
@@ -542,20 +822,131 @@ def delete_a_quick(id: int = Path(), auth: str = Header(...)):
     summary="Update a quick",
     tags=["Quicks"]
 )
-def update_a_quick(id: int = Path(), auth: str = Header(...), new_data: UpdateQuick = Body(...)):
-    db = Session()
-    data = validate_token(auth)
-    current_user = db.query(UserModel).filter(UserModel.email == data['email']).first()
-    quick_to_update = db.query(QuickModel).filter(QuickModel.quick_id == id).first()
+async def update_a_quick(id: int = Path(), current_user: Principal = Depends(get_current_user), new_data: UpdateQuick = Body(...), db = Depends(get_db)):
+    quick_to_update = await db.get(QuickModel, id)
     if new_data.content == quick_to_update.content:
-        return JSONResponse(status_code=400, content={'message': 'No changes'})
-    elif current_user.nick_name == quick_to_update.by:
+        return ORJSONResponse(status_code=400, content={'message': 'No changes'})
+    elif current_user.user_id == quick_to_update.author_id:
         quick_to_update.content = new_data.content
-        quick_to_update.by = current_user.nick_name
         quick_to_update.updated_at = new_data.updated_at
-        db.commit()
-        return JSONResponse(status_code=200, content={'message': 'Quick updated!'})
+        await timeline.touch(db, current_user.user_id)
+        await db.commit()
+        await entity_cache.quicks.invalidate(id)
+        return ORJSONResponse(status_code=200, content={'message': 'Quick updated!'})
     else:
-        return JSONResponse(status_code=400, content={'message': 'You can not update this quick'})
+        return ORJSONResponse(status_code=400, content={'message': 'You can not update this quick'})
 
-    
+
+## Live feed
+
+### Stream quicks over a WebSocket
+@app.websocket("/stream")
+async def stream_quicks(websocket: WebSocket, token: Optional[str] = Query(default=None)):
+    """
+        Stream quicks
+
+        This websocket pushes the quicks of the users you follow as they are posted
+
+        Parameters:
+            - Query parameter
+                - token: the login token, or send it in the auth header
+
+        Sends json messages:
+            {"type": "quick", "quick": quick} with the fields of the feed
+            {"type": "lagged", "dropped": int} when messages were dropped because
+            you read too slowly, reload the feed with GET /
+    """
+    subscription = await stream.subscribe(token or websocket.headers.get('auth'))
+    if subscription is None:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    async def pump():
+        while True:
+            data = await subscription.next()
+            await websocket.send_text(data.decode())
+
+    sender = asyncio.create_task(pump())
+    try:
+        # Nothing is expected from the client, reading only notices it leave
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+    finally:
+        sender.cancel()
+        stream.hub.disconnect(subscription)
+
+### Stream quicks as server-sent events
+@app.get(
+    path="/stream",
+    status_code=status.HTTP_200_OK,
+    summary="Stream quicks as server-sent events",
+    tags=["Quicks"]
+)
+async def stream_quick_events(token: Optional[str] = Query(default=None), auth: Optional[str] = Header(default=None)):
+    """
+        Stream quicks
+
+        This path operation is the fallback of the /stream websocket for
+        clients that can not open one, the same messages as server-sent events
+
+        Parameters:
+            - Query parameter
+                - token: the login token, or send it in the auth header
+
+        Returns a text/event-stream with one json message per event
+    """
+    subscription = await stream.subscribe(token or auth)
+    if subscription is None:
+        return ORJSONResponse(status_code=403, content={'message': 'Credenciales son invalidas'})
+
+    async def events():
+        try:
+            while True:
+                data = await subscription.next(stream.STREAM_HEARTBEAT)
+                # A comment on idle streams keeps proxies from closing them
+                yield b'data: ' + data + b'\n\n' if data is not None else b': ping\n\n'
+        finally:
+            stream.hub.disconnect(subscription)
+
+    return StreamingResponse(
+        events(), media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+## Status
+
+### Connection pool
+@app.get(
+    path="/status/pool",
+    status_code=status.HTTP_200_OK,
+    summary="Show the database connection pool status",
+    tags=["Status"]
+)
+async def show_pool_status():
+    """
+    This path operation shows how busy the database connection pool is
+
+    Returns a json with the pool size, checked out and overflow connections,
+    utilization and the average and max time requests waited for a connection,
+    and which read replicas are healthy when there are any
+    """
+    return ORJSONResponse(status_code=200, content=pool_status())
+
+### Metrics
+@app.get(
+    path="/metrics",
+    status_code=status.HTTP_200_OK,
+    summary="Export metrics for Prometheus",
+    tags=["Status"],
+    response_class=PlainTextResponse
+)
+async def show_metrics():
+    """
+    This path operation exports the app metrics in the Prometheus text format
+
+    Returns request counts and latency histograms by route and status,
+    requests in flight, connection pool gauges and the bcrypt queue depth
+    """
+    return PlainTextResponse(metrics_registry.render(), media_type='text/plain; version=0.0.4')
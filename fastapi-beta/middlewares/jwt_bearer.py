@@ -1,20 +1,68 @@
+import os
+import time
+from typing import NamedTuple
+from jwt import InvalidTokenError
 from fastapi.security import HTTPBearer
-from fastapi import Request, HTTPException
+from fastapi import Depends, Header, Request, HTTPException
+from sqlalchemy import select
 from utils.jwt_manager import validate_token
-from config.database import Session
+from utils.cache import TTLCache
+from config.database import get_db
 from models.models import User as UserModel
 
 
+class Principal(NamedTuple):
+    user_id: int
+    email: str
+    nick_name: str
+
+
+# Resolved users keyed by token, and the tokens seen for each user id so
+# they can be dropped when the user changes or goes away
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', 60))
+principals_by_token = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+tokens_by_user = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+# Users whose account is being deleted in the background, their tokens are
+# refused until the job is over even though the user row still exists
+deleting_users = set()
+
+
+async def resolve_principal(token: str, db) -> Principal:
+    """Return the user a token belongs to, raises 403 when it does not resolve"""
+    principal = principals_by_token.get(token)
+    if principal is not None:
+        if principal.user_id in deleting_users:
+            raise HTTPException(status_code=403, detail="Credenciales son invalidas")
+        return principal
+    try:
+        data = validate_token(token)
+    except InvalidTokenError:
+        raise HTTPException(status_code=403, detail="Credenciales son invalidas")
+    user = (await db.scalars(select(UserModel).filter(UserModel.email == data.get('email')))).first()
+    if user is None or user.user_id in deleting_users:
+        raise HTTPException(status_code=403, detail="Credenciales son invalidas")
+
+    principal = Principal(user.user_id, user.email, user.nick_name)
+    ttl = data['exp'] - time.time() if 'exp' in data else None
+    principals_by_token.set(token, principal, ttl)
+    tokens = tokens_by_user.get(user.user_id) or set()
+    tokens.add(token)
+    tokens_by_user.set(user.user_id, tokens)
+    return principal
+
+
+def invalidate_principal(user_id: int):
+    for token in tokens_by_user.pop(user_id, ()):
+        principals_by_token.pop(token)
+
+
+async def get_current_user(auth: str = Header(...), db = Depends(get_db)) -> Principal:
+    return await resolve_principal(auth, db)
+
 
 class JWTBearer(HTTPBearer):
-    async def __call__(self, request: Request):
+    async def __call__(self, request: Request, db = Depends(get_db)):
         auth = await super().__call__(request)
-        data = validate_token(auth.credentials)
-        db = Session()
-        user = db.query(UserModel).filter(UserModel.email == data['email']).first()
-        if data['email'] != user.email:
-               raise HTTPException(status_code=403, detail="Credenciales son invalidas")
-        
-        request.state.current_user = data
+        request.state.current_user = await resolve_principal(auth.credentials, db)
         return auth
-    
\ No newline at end of file
@@ -0,0 +1,80 @@
+import time
+from starlette.routing import Match
+from config.database import async_engine, pool_stats
+from utils.metrics import registry, Counter, Gauge, Histogram
+from utils.password_manager import queue_depth
+
+LABELS = ('method', 'route', 'status')
+
+requests_total = registry.register(Counter(
+    'http_requests_total', 'Requests served, by route template and status', LABELS))
+requests_in_flight = registry.register(Gauge(
+    'http_requests_in_flight', 'Requests being served right now'))
+request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Time to serve a request, by route template and status', LABELS))
+
+
+def _pool_gauge(method: str):
+    def read():
+        pool = async_engine.pool
+        # NullPool and StaticPool do not keep track of their connections
+        return getattr(pool, method)() if hasattr(pool, 'checkedout') else None
+    return read
+
+
+registry.register(Gauge('db_pool_checked_out', 'Connections in use by requests',
+                        function=_pool_gauge('checkedout')))
+registry.register(Gauge('db_pool_overflow', 'Connections opened beyond the pool size',
+                        function=_pool_gauge('overflow')))
+registry.register(Counter('db_pool_checkouts_total', 'Connections handed out to requests',
+                        function=lambda: pool_stats.checkouts))
+registry.register(Counter('db_pool_checkout_wait_seconds_total', 'Time requests spent waiting for a connection',
+                        function=lambda: pool_stats.wait_total))
+registry.register(Gauge('bcrypt_queue_depth', 'Password hashes running or waiting for a worker',
+                        function=queue_depth))
+
+
+class MetricsMiddleware:
+    """
+    Counts requests and times them by route template (/quicks/{id}, not
+    /quicks/12) so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.routes = None
+
+    def route_of(self, scope) -> str:
+        if self.routes is None:
+            # Routing stores the matched endpoint in the scope, map it back to its template
+            self.routes = {route.endpoint: route.path for route in scope['app'].routes if hasattr(route, 'endpoint')}
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            # Answered before routing ran (rate limited or shed), match the path here
+            for route in scope['app'].routes:
+                if route.matches(scope)[0] != Match.NONE:
+                    return route.path
+            return 'unmatched'
+        return self.routes.get(endpoint, 'unmatched')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            labels = (scope['method'], self.route_of(scope), status_code)
+            request_duration.observe(time.perf_counter() - start, labels)
+            requests_total.inc(labels)
+            requests_in_flight.dec()
@@ -0,0 +1,226 @@
+"""
+Rate limiting and admission control
+
+Requests to the routes in ROUTE_LIMITS take a token from a bucket per client
+IP and, when they carry an auth token, one per principal. The principal is a
+hash of the raw auth token, it is not validated here: a forged one gets its
+own bucket but the route still refuses it.
+An empty bucket answers 429 with Retry-After. Buckets live in process memory
+unless RATE_LIMIT_STORE_URL points at a shared store (redis://...) so every
+instance draws from the same ones.
+
+Routes in DB_HEAVY_ROUTES also need one of DB_CONCURRENCY_LIMIT slots. A
+request waits up to ADMISSION_TIMEOUT seconds for one, and gets a 503 with
+Retry-After when none frees up or too many requests are already waiting.
+"""
+import os
+import math
+import hashlib
+import time
+import asyncio
+from typing import NamedTuple
+from fastapi.responses import ORJSONResponse
+from starlette.datastructures import Headers
+from config.database import env_flag, pool_options
+from utils.cache import TTLCache
+from utils.jwt_manager import request_token
+
+
+class Limit(NamedTuple):
+    rate: float   # tokens added per second
+    burst: int    # bucket size
+
+
+def per_minute(count: int, burst: int = None) -> Limit:
+    return Limit(count / 60, burst or count)
+
+
+# (method, route template) -> limits per IP and per principal, None for no limit
+ROUTE_LIMITS = {
+    ('POST', '/login'): (per_minute(10), None),
+    ('POST', '/signup'): (per_minute(5), None),
+    ('POST', '/post'): (per_minute(120), per_minute(30, 10)),
+    ('POST', '/follow'): (per_minute(240), per_minute(60, 20)),
+    ('POST', '/unfollow'): (per_minute(240), per_minute(60, 20)),
+    # A batch takes one token for up to MAX_BATCH_SIZE items, so far fewer of them
+    ('POST', '/post/batch'): (per_minute(12), per_minute(3, 2)),
+    ('POST', '/follow/batch'): (per_minute(24), per_minute(6, 2)),
+}
+DB_HEAVY_ROUTES = {
+    ('GET', '/'),
+    ('GET', '/usersfollowed'),
+    ('GET', '/myfollowers'),
+    ('GET', '/search'),
+    ('DELETE', '/users/delete'),
+}
+
+RATE_LIMIT_ENABLED = env_flag('RATE_LIMIT_ENABLED', True)
+RATE_LIMIT_STORE_URL = os.environ.get('RATE_LIMIT_STORE_URL')
+# Take the client address from X-Forwarded-For, only behind a proxy that sets it
+TRUST_FORWARDED_FOR = env_flag('TRUST_FORWARDED_FOR', False)
+# Leave some connections of the pool to the routes that are not limited
+DB_CONCURRENCY_LIMIT = int(os.environ.get(
+    'DB_CONCURRENCY_LIMIT', max(1, pool_options.get('pool_size', 5) + pool_options.get('max_overflow', 10) - 2)
+))
+ADMISSION_TIMEOUT = float(os.environ.get('ADMISSION_TIMEOUT', 0.5))
+ADMISSION_QUEUE_LIMIT = int(os.environ.get('ADMISSION_QUEUE_LIMIT', 100))
+
+
+class MemoryBucketStore:
+    """
+    Token buckets in process memory. A shared store implements the same
+    `take`, returning 0 when a token was taken or the seconds until one is free.
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        # Idle buckets are full again after burst / rate seconds, an hour covers every limit above
+        self.buckets = TTLCache(maxsize=maxsize, ttl=3600)
+
+    async def take(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key) or (limit.burst, now)
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+        if tokens < 1:
+            self.buckets.set(key, (tokens, now))
+            return (1 - tokens) / limit.rate
+        self.buckets.set(key, (tokens - 1, now))
+        return 0.0
+
+
+class RedisBucketStore:
+    # Refill and take in one round trip, atomically for every instance
+    SCRIPT = '''
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        local wait = 0
+        if tokens < 1 then
+            wait = (1 - tokens) / rate
+        else
+            tokens = tokens - 1
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    '''
+
+    def __init__(self, url: str):
+        import redis.asyncio
+        self.client = redis.asyncio.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    async def take(self, key: str, limit: Limit) -> float:
+        wait = await self.script(keys=[f'ratelimit:{key}'], args=[limit.rate, limit.burst, time.time()])
+        return float(wait)
+
+
+def bucket_store(url: str):
+    if not url or url.startswith('memory://'):
+        return MemoryBucketStore()
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBucketStore(url)
+    raise ValueError(f"Unsupported RATE_LIMIT_STORE_URL {url!r}")
+
+
+class AdmissionLimiter:
+    """At most `limit` requests at once, the rest wait briefly in line"""
+
+    def __init__(self, limit: int, timeout: float, queue_limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.timeout = timeout
+        self.queue_limit = queue_limit
+        self.waiting = 0
+
+    async def acquire(self) -> bool:
+        if self.semaphore.locked() and self.waiting >= self.queue_limit:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self.semaphore.release()
+
+
+def _header(scope, name: bytes):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, store=None):
+        self.app = app
+        self.store = store or bucket_store(RATE_LIMIT_STORE_URL)
+        self.admission = AdmissionLimiter(DB_CONCURRENCY_LIMIT, ADMISSION_TIMEOUT, ADMISSION_QUEUE_LIMIT)
+        self.routes = None
+
+    def route_of(self, scope):
+        if self.routes is None:
+            # Only the limited routes are matched here, before the router runs
+            limited = {path for _, path in ROUTE_LIMITS} | {path for _, path in DB_HEAVY_ROUTES}
+            self.routes = [
+                (route.path_regex, route.path) for route in scope['app'].routes
+                if getattr(route, 'path', None) in limited
+            ]
+        for regex, path in self.routes:
+            if regex.match(scope['path']):
+                return path
+        return None
+
+    def client_ip(self, scope) -> str:
+        if TRUST_FORWARDED_FOR:
+            forwarded = _header(scope, b'x-forwarded-for')
+            if forwarded:
+                return forwarded.split(',')[0].strip()
+        return scope['client'][0] if scope.get('client') else 'unknown'
+
+    def principal(self, scope):
+        token = request_token(Headers(scope=scope))
+        # Hashed, so the shared store never holds usable tokens
+        return hashlib.sha256(token.encode()).hexdigest() if token else None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not RATE_LIMIT_ENABLED:
+            return await self.app(scope, receive, send)
+        route = self.route_of(scope)
+        if route is None:
+            return await self.app(scope, receive, send)
+        key = (scope['method'], route)
+
+        limits = ROUTE_LIMITS.get(key)
+        if limits:
+            ip_limit, principal_limit = limits
+            wait = 0.0
+            if ip_limit:
+                wait = await self.store.take(f'ip:{self.client_ip(scope)}:{route}', ip_limit)
+            principal = self.principal(scope) if principal_limit else None
+            if not wait and principal:
+                wait = await self.store.take(f'user:{principal}:{route}', principal_limit)
+            if wait:
+                response = ORJSONResponse(
+                    status_code=429, content={'message': 'Too many requests, try again later'},
+                    headers={'Retry-After': str(math.ceil(wait))}
+                )
+                return await response(scope, receive, send)
+
+        if key not in DB_HEAVY_ROUTES:
+            return await self.app(scope, receive, send)
+        if not await self.admission.acquire():
+            response = ORJSONResponse(
+                status_code=503, content={'message': 'Server busy, try again later'},
+                headers={'Retry-After': '1'}
+            )
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release()
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import random
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Share of requests whose SQL stats are logged, requests flagged as N+1 are always logged
+SQL_LOG_SAMPLE_RATE = float(os.environ.get('SQL_LOG_SAMPLE_RATE', 0.01))
+# A request running the same statement more times than this is flagged as N+1
+SQL_REPEAT_THRESHOLD = int(os.environ.get('SQL_REPEAT_THRESHOLD', 10))
+
+
+class RequestStats:
+    """Statements run while serving one request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, elapsed: float):
+        self.queries += 1
+        self.db_time += elapsed
+        # Values are bound parameters, so the text is already the statement shape
+        self.shapes[' '.join(statement.split())] += 1
+
+    def repeated(self) -> list:
+        return [
+            {'statement': shape, 'count': count}
+            for shape, count in self.shapes.most_common()
+            if count > SQL_REPEAT_THRESHOLD
+        ]
+
+
+current_stats: ContextVar = ContextVar('sql_request_stats', default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def instrument(engine):
+    """Count and time the statements of an engine, pass async_engine.sync_engine for async ones"""
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class SQLTimingMiddleware:
+    """
+    Adds a Server-Timing header with the number of statements and the time
+    spent in the database to every response, and logs the same figures as
+    JSON for a sample of requests and for requests that look like N+1.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                total = (time.perf_counter() - start) * 1000
+                timing = (f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+                          f'app;dur={total:.1f}')
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'server-timing', timing.encode('latin-1'))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_stats.reset(token)
+            self.log(scope, status_code, stats, time.perf_counter() - start)
+
+    def log(self, scope, status_code: int, stats: RequestStats, elapsed: float):
+        repeated = stats.repeated()
+        if not repeated and random.random() >= SQL_LOG_SAMPLE_RATE:
+            return
+        record = {
+            'method': scope['method'],
+            'path': scope['path'],
+            'status': status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 2),
+        }
+        if repeated:
+            record['repeated_statements'] = repeated
+            logger.warning("Possible N+1 queries: %s", json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
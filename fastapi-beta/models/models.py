@@ -1,5 +1,17 @@
 from config.database import Base
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, PrimaryKeyConstraint
+from sqlalchemy.ext.compiler import compiles
+
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def _primary_key(constraint, compiler, **kw):
+    # Postgres wants the partition key in the primary key of a partitioned
+    # table, the mapper still identifies rows by the declared primary key
+    partition_key = constraint.table.info.get('partition_key')
+    if partition_key is None:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    columns = [column.name for column in constraint.columns] + [partition_key]
+    return 'PRIMARY KEY (%s)' % ', '.join(compiler.preparer.quote(name) for name in columns)
 
 
 class User(Base):
@@ -14,6 +26,8 @@ class User(Base):
     birth_date = Column(DateTime)
     followers = Column(Integer)
     nick_name = Column(String, unique=True)
+    # Last change to the profile or a quick of the user, part of their followers' feed ETags
+    updated_at = Column(DateTime)
 
     class Config:
         orm_mode = True
@@ -23,11 +37,26 @@ class Quick(Base):
 
     __tablename__ = "Quick"
 
-    quick_id = Column(Integer, primary_key = True, unique = True)
+    quick_id = Column(Integer, primary_key = True)
     content = Column (String)
     created_at = Column(DateTime)
     updated_at = Column(DateTime)
-    by = Column(String, ForeignKey('Users.nick_name'))
+    # Nick name of the author when the quick was posted, author_id is the reference to follow
+    by = Column(String)
+    author_id = Column(Integer, ForeignKey('Users.user_id'))
+
+    __table_args__ = (
+        Index('ix_quick_created', created_at.desc(), quick_id.desc()),
+        Index('ix_quick_updated', updated_at),
+        Index('ix_quick_author_created', author_id, created_at.desc(), quick_id.desc()),
+        # Monthly partitions on Postgres, kept by utils/partitions.py. SQLite
+        # must not hand out the ids of quicks it moved out to archive tables
+        {
+            'postgresql_partition_by': 'RANGE (created_at)',
+            'sqlite_autoincrement': True,
+            'info': {'partition_key': 'created_at'},
+        },
+    )
 
 class Followers(Base):
 
@@ -36,5 +65,24 @@ class Followers(Base):
     follow_id = Column(Integer, primary_key=True)
     follower_id = Column(Integer, ForeignKey('Users.user_id'))
     user_followed_id = Column(Integer, ForeignKey('Users.user_id'))
-    
-    
+
+    __table_args__ = (
+        Index('ix_followers_follower', follower_id, follow_id),
+        Index('ux_followers_edge', follower_id, user_followed_id, unique=True),
+        Index('ix_followers_followed', user_followed_id, follow_id),
+        Index('ix_followers_fan_out', user_followed_id, follower_id),
+    )
+
+class Timeline(Base):
+
+    __tablename__ = "Timeline"
+
+    user_id = Column(Integer, ForeignKey('Users.user_id'), primary_key=True)
+    # No foreign key: a partitioned "Quick" has no unique quick_id to reference,
+    # entries of archived quicks are pruned with them
+    quick_id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_timeline_user_created', 'user_id', created_at.desc(), quick_id.desc()),
+    )
@@ -0,0 +1,102 @@
+"""
+The app runs in process against SQLite files in a temporary directory, with
+the memory:// stand-in for the shared entity cache. Settings are read when
+the app is imported, so they are set before that.
+"""
+import os
+import sqlite3
+import tempfile
+import pytest
+
+DATA_DIR = tempfile.mkdtemp(prefix='quicker-tests-')
+PRIMARY = os.path.join(DATA_DIR, 'primary.sqlite')
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{PRIMARY}',
+    'ENTITY_CACHE_URL': 'memory://',
+    'RATE_LIMIT_ENABLED': 'false',
+    'CREATE_SCHEMA': 'false',
+})
+for name in ('ASYNC_DATABASE_URL', 'DATABASE_REPLICA_URLS', 'STREAM_BROKER_URL', 'POST_BUFFER_ENABLED'):
+    os.environ.pop(name, None)
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+import main
+from config.database import Base, engine, replicas, to_async_url, pool_options_for
+from middlewares import jwt_bearer
+from utils import entity_cache, timeline
+
+
+def reset_state():
+    """Forget what the previous test left in process memory"""
+    for cache in (entity_cache.profiles, entity_cache.quicks):
+        for store in (cache.local, cache.recent, cache.recent_groups, cache.generations):
+            store.clear()
+        cache.loading.clear()
+    if entity_cache.shared is not None:
+        entity_cache.shared.entries.clear()
+    jwt_bearer.principals_by_token.clear()
+    jwt_bearer.tokens_by_user.clear()
+    jwt_bearer.deleting_users.clear()
+    replicas.pins.clear()
+    replicas.retry_at.clear()
+    timeline.trimmer.authors.clear()
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+async def client():
+    """A client of the app on an empty database"""
+    with engine.begin() as conn:
+        # The full-text search table is not part of the metadata, drop_all leaves it
+        conn.execute(text('DROP TABLE IF EXISTS quick_search'))
+        Base.metadata.drop_all(conn)
+        Base.metadata.create_all(conn)
+    reset_state()
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app), \
+            httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        yield client
+
+
+@pytest.fixture
+def signup(client):
+    """Register and log in a user, returns the headers that authenticate them"""
+    async def signup(nick_name: str) -> dict:
+        user = {
+            'email': f'{nick_name}@example.com', 'nick_name': nick_name, 'first_name': 'Test',
+            'last_name': 'User', 'birth_date': '1990-01-01', 'password': 'test-password',
+        }
+        assert (await client.post('/signup', json=user)).status_code == 201
+        login = await client.post('/login', json={'email': user['email'], 'password': user['password']})
+        token = login.json()['token']
+        return {'auth': token, 'Authorization': f'Bearer {token}'}
+    return signup
+
+
+@pytest.fixture
+def replica(tmp_path):
+    """
+    A read replica on a SQLite file of its own. Calling the fixture copies
+    the primary into it, standing in for replication.
+    """
+    url = f'sqlite:///{tmp_path / "replica.sqlite"}'
+    replica_engine = create_async_engine(to_async_url(url), **pool_options_for(url))
+
+    def replicate():
+        source, target = sqlite3.connect(PRIMARY), sqlite3.connect(tmp_path / 'replica.sqlite')
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+
+    replicate()
+    replicas.engines.append(replica_engine)
+    yield replicate
+    replicas.engines.remove(replica_engine)
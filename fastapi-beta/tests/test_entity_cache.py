@@ -0,0 +1,90 @@
+import pytest
+from utils.entity_cache import EntityCache, MemoryBackend, cached_response
+
+pytestmark = pytest.mark.anyio
+
+
+def profile(nick_name: str) -> dict:
+    return {
+        'email': f'{nick_name}@example.com', 'nick_name': nick_name, 'first_name': 'Test',
+        'last_name': 'User', 'birth_date': '1990-01-01', 'password': 'test-password',
+    }
+
+
+async def test_profile_is_invalidated_on_update(client, signup):
+    user = await signup('before')
+    assert (await client.get('/users/before')).status_code == 200
+
+    assert (await client.put('/users/update', json=profile('after'), headers=user)).status_code == 200
+
+    assert (await client.get('/users/before')).status_code == 404
+    response = await client.get('/users/after')
+    assert response.status_code == 200
+    assert response.json()['nick_name'] == 'after'
+
+
+async def test_quick_is_invalidated_on_edit_and_delete(client, signup):
+    author = await signup('author')
+    await client.post('/post', json={'content': 'first draft'}, headers=author)
+    cached = await client.get('/quicks/1')
+    assert cached.json()['content'] == 'first draft'
+
+    await client.put('/quicks/1/update', json={'content': 'second draft'}, headers=author)
+    edited = await client.get('/quicks/1')
+    assert edited.json()['content'] == 'second draft'
+    assert edited.headers['ETag'] != cached.headers['ETag']
+    assert (await client.get('/quicks/1', headers={'If-None-Match': cached.headers['ETag']})).status_code == 200
+
+    await client.put('/quicks/1/delete', headers=author)
+    assert (await client.get('/quicks/1')).json()['content'] == 'Quick deleted'
+
+
+async def test_rename_reaches_cached_quicks(client, signup):
+    author = await signup('old_nick')
+    for content in ('one', 'two'):
+        await client.post('/post', json={'content': content}, headers=author)
+    assert (await client.get('/quicks/1')).json()['by'] == 'old_nick'
+    assert (await client.get('/quicks/batch', params={'ids': '1,2'})).status_code == 200
+
+    await client.put('/users/update', json=profile('new_nick'), headers=author)
+
+    assert (await client.get('/quicks/1')).json()['by'] == 'new_nick'
+    batch = (await client.get('/quicks/batch', params={'ids': '1,2'})).json()
+    assert [item['quick']['by'] for item in batch] == ['new_nick', 'new_nick']
+
+
+async def test_account_deletion_drops_cached_entries(client, signup):
+    user = await signup('leaving')
+    await client.post('/post', json={'content': 'goodbye'}, headers=user)
+    assert (await client.get('/users/leaving')).status_code == 200
+    assert (await client.get('/quicks/1')).status_code == 200
+
+    assert (await client.delete('/users/delete', headers=user)).status_code == 200
+
+    assert (await client.get('/users/leaving')).status_code == 404
+    assert (await client.get('/quicks/1')).status_code == 404
+
+
+async def test_workers_sharing_a_backend_see_invalidations_and_bumps():
+    shared = MemoryBackend()
+    worker, other_worker = EntityCache('quick', shared), EntityCache('quick', shared)
+    version = {'content': 'v1'}
+
+    async def load():
+        return cached_response(f'"{version["content"]}"', dict(version), 7)
+
+    assert (await worker.get_or_load(1, load)).etag == '"v1"'
+    assert (await other_worker.get_or_load(1, load)).etag == '"v1"'
+
+    version['content'] = 'v2'
+    await worker.invalidate(1)
+    # Local copies are only kept ENTITY_CACHE_LOCAL_TTL seconds, this one has expired
+    other_worker.local.clear()
+    assert (await other_worker.get_or_load(1, load)).etag == '"v2"'
+
+    version['content'] = 'v3'
+    await worker.bump(7)
+    # Both expired, the entry in the shared backend is then checked against the new generation
+    other_worker.local.clear()
+    other_worker.generations.clear()
+    assert (await other_worker.get_or_load(1, load)).etag == '"v3"'
@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from config.database import replicas
+
+pytestmark = pytest.mark.anyio
+
+
+async def found(client, word, headers=None):
+    response = await client.get('/search', params={'q': word}, headers=headers or {})
+    assert response.status_code == 200
+    return [quick['content'] for quick in response.json()]
+
+
+async def test_writer_is_pinned_to_primary(client, signup, replica):
+    writer, reader = await signup('writer'), await signup('reader')
+    replica()
+
+    assert (await client.post('/post', json={'content': 'fresh news'}, headers=writer)).status_code == 201
+
+    # The writer reads their own write, the replica has not caught up for the others
+    assert replicas.pinned(writer['auth'])
+    assert await found(client, 'fresh', writer) == ['fresh news']
+    assert await found(client, 'fresh', reader) == []
+    assert await found(client, 'fresh') == []
+
+    replicas.pins.clear()
+    assert await found(client, 'fresh', writer) == []
+
+    replica()
+    assert await found(client, 'fresh', reader) == ['fresh news']
+
+
+async def test_unreachable_replica_falls_back_to_primary(client, signup):
+    author = await signup('author')
+    await client.post('/post', json={'content': 'still served'}, headers=author)
+
+    broken = create_async_engine('sqlite+aiosqlite:////nonexistent/replica.sqlite')
+    replicas.engines.append(broken)
+    try:
+        assert await found(client, 'served') == ['still served']
+        assert replicas.status() == [{'replica': 0, 'healthy': False}]
+        # Until the retry delay passes the replica is skipped without a new attempt
+        assert await found(client, 'served') == ['still served']
+    finally:
+        replicas.engines.remove(broken)
+        await broken.dispose()
@@ -0,0 +1,41 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def search(client, words: str) -> list:
+    response = await client.get('/search', params={'q': words})
+    assert response.status_code == 200
+    return [quick['content'] for quick in response.json()]
+
+
+async def test_search_follows_edits(client, signup):
+    author = await signup('author')
+    await client.post('/post', json={'content': 'walking the dog'}, headers=author)
+    assert await search(client, 'dog') == ['walking the dog']
+
+    await client.put('/quicks/1/update', json={'content': 'feeding the cat'}, headers=author)
+
+    assert await search(client, 'dog') == []
+    assert await search(client, 'cat') == ['feeding the cat']
+
+
+async def test_search_drops_deleted_quicks(client, signup):
+    author = await signup('author')
+    for content in ('rainy monday', 'sunny monday'):
+        await client.post('/post', json={'content': content}, headers=author)
+
+    await client.put('/quicks/1/delete', headers=author)
+
+    assert await search(client, 'monday') == ['sunny monday']
+    assert await search(client, 'rainy') == []
+
+
+async def test_search_drops_quicks_of_deleted_accounts(client, signup):
+    leaving, staying = await signup('leaving'), await signup('staying')
+    await client.post('/post', json={'content': 'last words'}, headers=leaving)
+    await client.post('/post', json={'content': 'more words'}, headers=staying)
+
+    await client.delete('/users/delete', headers=leaving)
+
+    assert await search(client, 'words') == ['more words']
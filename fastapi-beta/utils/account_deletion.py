@@ -0,0 +1,169 @@
+"""
+Account deletion
+
+Small accounts are deleted inside the request. Accounts with more than
+DELETE_BACKGROUND_THRESHOLD quicks and follow edges are handed to a job,
+detached from the request so its session and admission slot are released
+with the 202. The job removes the quicks DELETE_BATCH_SIZE at a time, one
+transaction each, then the account.
+
+Jobs and the users being deleted live in the memory of the worker that
+took the request: with several workers, GET /users/delete/{job_id} only
+finds the job on that worker, and the others keep accepting the user's
+token until the user row is gone and their principal cache expires
+(PRINCIPAL_CACHE_TTL).
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import select, update, delete, func, or_
+from config.database import AsyncSession
+from models.models import User as UserModel
+from models.models import Quick as QuickModel
+from models.models import Followers
+from models.models import Timeline
+from utils.cache import TTLCache
+from utils import entity_cache
+from utils.partitions import delete_archived_quicks
+from utils.tasks import start_detached
+from middlewares.jwt_bearer import invalidate_principal, deleting_users
+
+logger = logging.getLogger(__name__)
+
+# Accounts with more quicks and follow edges than this are deleted in the background
+DELETE_BACKGROUND_THRESHOLD = int(os.environ.get('DELETE_BACKGROUND_THRESHOLD', 5000))
+# Quicks removed per transaction by background deletions
+DELETE_BATCH_SIZE = int(os.environ.get('DELETE_BATCH_SIZE', 1000))
+
+# Status of background deletions, kept for a day
+jobs = TTLCache(maxsize=1000, ttl=86400)
+# Tasks of the jobs running in this worker, shutdown waits for them
+running = set()
+
+
+async def account_size(db, user_id: int) -> int:
+    """Quicks plus follow edges of a user, counted up to DELETE_BACKGROUND_THRESHOLD + 1"""
+    cap = DELETE_BACKGROUND_THRESHOLD + 1
+    quicks = select(QuickModel.quick_id).where(QuickModel.author_id == user_id).limit(cap).subquery()
+    edges = (
+        select(Followers.follow_id)
+        .where(or_(Followers.follower_id == user_id, Followers.user_followed_id == user_id))
+        .limit(cap)
+        .subquery()
+    )
+    return (
+        await db.scalar(select(func.count()).select_from(quicks))
+        + await db.scalar(select(func.count()).select_from(edges))
+    )
+
+
+async def delete_quicks(db, user_id: int, batch_size: int = None) -> list:
+    """
+    Delete the quicks of a user and their timeline entries, returns the ids
+    of the deleted quicks. With a batch_size they are removed and committed
+    batch_size quicks at a time.
+    """
+    # Only followers have the quicks in their timeline, and the primary key
+    # (user_id, quick_id) finds the entries of each of them
+    followers = select(Followers.follower_id).where(Followers.user_followed_id == user_id)
+    if batch_size is None:
+        quick_ids = select(QuickModel.quick_id).where(QuickModel.author_id == user_id)
+        await db.execute(delete(Timeline).where(Timeline.user_id.in_(followers), Timeline.quick_id.in_(quick_ids)))
+        result = await db.execute(
+            delete(QuickModel).where(QuickModel.author_id == user_id).returning(QuickModel.quick_id)
+        )
+        return result.scalars().all()
+
+    batch = (await db.scalars(
+        select(QuickModel.quick_id).where(QuickModel.author_id == user_id).limit(batch_size)
+    )).all()
+    if batch:
+        await db.execute(delete(Timeline).where(Timeline.user_id.in_(followers), Timeline.quick_id.in_(batch)))
+        await db.execute(delete(QuickModel).where(QuickModel.quick_id.in_(batch)))
+        await db.commit()
+    return batch
+
+
+async def delete_account(db, user_id: int, nick_name: str) -> tuple:
+    """
+    Remove a user, their quicks and follow edges with a handful of set-based
+    statements. Returns the deleted quick ids and the nick names of the users
+    that lost a follower, whose cached entries change once this is committed.
+    """
+    quick_ids = await delete_quicks(db, user_id)
+    # Archived quicks have no timeline entries or cache entries left, only rows
+    await db.run_sync(lambda session: delete_archived_quicks(session.connection(), user_id))
+    await db.execute(delete(Timeline).where(Timeline.user_id == user_id))
+    # UPDATE ... FROM "Followers": one decrement for every user this one followed
+    followed = await db.execute(
+        update(UserModel)
+        .where(UserModel.user_id == Followers.user_followed_id, Followers.follower_id == user_id)
+        .values(followers=UserModel.followers - 1)
+        .returning(UserModel.nick_name)
+        .execution_options(synchronize_session=False)
+    )
+    followed_nick_names = followed.scalars().all()
+    await db.execute(
+        delete(Followers)
+        .where(or_(Followers.follower_id == user_id, Followers.user_followed_id == user_id))
+    )
+    await db.execute(delete(UserModel).where(UserModel.user_id == user_id))
+    return quick_ids, followed_nick_names
+
+
+async def invalidate_account(nick_name: str, quick_ids: list, followed_nick_names: list):
+    await entity_cache.quicks.invalidate(*quick_ids)
+    await entity_cache.profiles.invalidate(nick_name, *followed_nick_names)
+
+
+def start_job(user_id: int, nick_name: str) -> str:
+    """Start deleting an account in the background, returns the job_id"""
+    job_id = uuid.uuid4().hex
+    jobs.set(job_id, {
+        'job_id': job_id,
+        'user_id': user_id,
+        'status': 'pending',
+        'deleted_quicks': 0,
+        'started_at': datetime.now().isoformat(),
+        'finished_at': None,
+    })
+    # The token stops working now, not once the job has removed the user
+    deleting_users.add(user_id)
+    invalidate_principal(user_id)
+    task = start_detached(run_job(job_id, user_id, nick_name))
+    running.add(task)
+    task.add_done_callback(running.discard)
+    return job_id
+
+
+async def run_job(job_id: str, user_id: int, nick_name: str):
+    """Background task: delete the quicks in batches, then the account itself"""
+    job = jobs.get(job_id)
+    job['status'] = 'running'
+    try:
+        async with AsyncSession() as db:
+            while True:
+                deleted = await delete_quicks(db, user_id, DELETE_BATCH_SIZE)
+                if not deleted:
+                    break
+                job['deleted_quicks'] += len(deleted)
+                await entity_cache.quicks.invalidate(*deleted)
+            quick_ids, followed_nick_names = await delete_account(db, user_id, nick_name)
+            await db.commit()
+            await invalidate_account(nick_name, quick_ids, followed_nick_names)
+        job['status'] = 'done'
+    except Exception:
+        logger.exception("Deleting user %s failed", user_id)
+        job['status'] = 'failed'
+    finally:
+        # A failed deletion leaves the user in place, their token works again
+        deleting_users.discard(user_id)
+        invalidate_principal(user_id)
+    job['finished_at'] = datetime.now().isoformat()
+
+
+async def wait_for_jobs():
+    """Let the running jobs finish, at shutdown"""
+    await asyncio.gather(*running)
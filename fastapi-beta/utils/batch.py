@@ -0,0 +1,32 @@
+import os
+import orjson
+from fastapi import HTTPException
+
+# Items a batch endpoint takes in one request
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 100))
+
+
+def parse_list(values: str, convert=str) -> list:
+    """Split a comma separated query parameter, without repeats and in order"""
+    try:
+        items = list(dict.fromkeys(convert(value.strip()) for value in values.split(',') if value.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid list of values")
+    if not items:
+        raise HTTPException(status_code=400, detail="Nothing was requested")
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} items per request")
+    return items
+
+
+def batch_body(items: list) -> bytes:
+    """A json list out of items that are already serialized"""
+    return b'[' + b','.join(items) + b']'
+
+
+def batch_item(fields: dict, name: str = None, body: bytes = None) -> bytes:
+    """One result of a batch: fields, and `name` holding an already serialized body when there is one"""
+    item = orjson.dumps(fields)
+    if body is None:
+        return item
+    return item[:-1] + b',"' + name.encode('ascii') + b'":' + body + b'}'
@@ -0,0 +1,141 @@
+"""
+Bulk user import
+
+Streams users from a CSV or NDJSON file (one JSON object per line) with the
+keys email, nick_name, first_name, last_name, birth_date and password, hashes
+the passwords in parallel across a process pool and inserts them in batches.
+Rows whose email or nick name already exist are skipped.
+
+    python -m utils.bulk_import users.csv
+    python -m utils.bulk_import users.ndjson --batch-size 10000 --workers 8 --copy
+"""
+import io
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+from datetime import date
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import text
+from config.database import engine
+from models.models import User as UserModel
+from utils.dialects import insert_for
+from utils.password_manager import hash_password_sync
+
+REQUIRED_FIELDS = ('email', 'nick_name', 'password')
+COLUMNS = ('email', 'password', 'first_name', 'last_name', 'birth_date', 'nick_name', 'followers')
+
+
+def read_rows(path: str, file_format: str):
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def clean(row: dict):
+    """Return the row as Users column values, or None when it can not be imported"""
+    if any(not row.get(field) for field in REQUIRED_FIELDS):
+        return None
+    try:
+        birth_date = date.fromisoformat(row['birth_date']) if row.get('birth_date') else None
+    except ValueError:
+        birth_date = None
+    return {
+        'email': row['email'].strip(),
+        'password': row['password'],
+        'first_name': row.get('first_name'),
+        'last_name': row.get('last_name'),
+        'birth_date': birth_date,
+        'nick_name': row['nick_name'].strip(),
+        'followers': 0,
+    }
+
+
+def batches(rows, size: int):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def insert_batch(conn, batch: list) -> int:
+    result = conn.execute(insert_for(conn)(UserModel).on_conflict_do_nothing(), batch)
+    return max(result.rowcount, 0)
+
+
+def copy_batch(conn, batch: list) -> int:
+    """Postgres only: COPY the batch into a staging table, then move the new users over"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow(['' if row[column] is None else row[column] for column in COLUMNS])
+    buffer.seek(0)
+    conn.execute(text(
+        'CREATE TEMP TABLE users_import (email varchar, password varchar, first_name varchar, '
+        'last_name varchar, birth_date timestamp, nick_name varchar, followers integer) ON COMMIT DROP'
+    ))
+    cursor = conn.connection.dbapi_connection.cursor()
+    cursor.copy_expert(f"COPY users_import ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    result = conn.execute(text(
+        f'INSERT INTO "Users" ({", ".join(COLUMNS)}) '
+        f'SELECT {", ".join(COLUMNS)} FROM users_import ON CONFLICT DO NOTHING'
+    ))
+    return max(result.rowcount, 0)
+
+
+def import_users(path: str, file_format: str, batch_size: int, workers: int, use_copy: bool) -> dict:
+    write = copy_batch if use_copy else insert_batch
+    stats = {'read': 0, 'skipped': 0, 'inserted': 0}
+    start = time.perf_counter()
+
+    def flush(batch, hashes):
+        for row, hashed in zip(batch, hashes):
+            row['password'] = hashed
+        with engine.begin() as conn:
+            stats['inserted'] += write(conn, batch)
+        print(f"{stats['read']} read, {stats['inserted']} inserted, "
+              f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = None
+        for raw_batch in batches(read_rows(path, file_format), batch_size):
+            stats['read'] += len(raw_batch)
+            batch = [row for row in map(clean, raw_batch) if row]
+            stats['skipped'] += len(raw_batch) - len(batch)
+            # Hash this batch in the pool while the previous one is written
+            hashes = pool.map(hash_password_sync, [row['password'] for row in batch],
+                              chunksize=max(1, len(batch) // (workers * 4)))
+            if pending:
+                flush(*pending)
+            pending = (batch, hashes)
+        if pending:
+            flush(*pending)
+
+    stats['seconds'] = round(time.perf_counter() - start, 2)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import users from a CSV or NDJSON file")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=('csv', 'ndjson'),
+                        help="defaults to the file extension")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--copy', action='store_true',
+                        help="load batches with COPY (Postgres only)")
+    args = parser.parse_args()
+
+    file_format = args.format or ('csv' if args.path.endswith('.csv') else 'ndjson')
+    if args.copy and engine.dialect.name != 'postgresql':
+        parser.error("--copy needs a Postgres database")
+    print(json.dumps(import_users(args.path, file_format, args.batch_size, args.workers, args.copy)))
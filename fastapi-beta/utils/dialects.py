@@ -0,0 +1,9 @@
+from importlib import import_module
+
+
+def insert_for(bind):
+    """
+    Return the dialect-specific insert() for an engine or connection, it
+    supports ON CONFLICT DO NOTHING. Only the dialect in use gets imported.
+    """
+    return import_module(f'sqlalchemy.dialects.{bind.dialect.name}').insert
@@ -0,0 +1,304 @@
+"""
+Read-through cache of serialized profiles and quicks
+
+Each entry is the response body of an entity together with its ETag. Entries
+live in an in-process LRU and, when ENTITY_CACHE_URL is set, in a shared
+backend so every instance sees the same entries and invalidations:
+
+    ENTITY_CACHE_URL=memory://                   in-process stand-in, for tests
+    ENTITY_CACHE_URL=redis://localhost:6379/0    needs the redis package
+
+With a shared backend the local copies only live ENTITY_CACHE_LOCAL_TTL
+seconds, which bounds how stale another instance's invalidation can leave them.
+
+Entries can belong to a group, the quicks of an author, whose generation they
+are stamped with. `bump` starts a new generation so every entry of the group
+is stale without listing them, an entry is only served while its stamp is
+the current generation.
+"""
+import os
+import uuid
+import asyncio
+import logging
+import orjson
+from typing import NamedTuple, Optional
+from utils.cache import TTLCache
+from config.database import replicas, REPLICA_PIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ENTITY_CACHE_URL = os.environ.get('ENTITY_CACHE_URL')
+ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', 10000))
+ENTITY_CACHE_TTL = float(os.environ.get('ENTITY_CACHE_TTL', 60))
+ENTITY_CACHE_LOCAL_TTL = float(os.environ.get('ENTITY_CACHE_LOCAL_TTL', 5))
+
+
+class CachedResponse(NamedTuple):
+    etag: str
+    body: bytes
+    group: Optional[int] = None
+    generation: Optional[str] = None
+
+    def encode(self) -> bytes:
+        stamp = '' if self.group is None else f'{self.group}:{self.generation}'
+        return f'{self.etag}\n{stamp}\n'.encode('ascii') + self.body
+
+    @classmethod
+    def decode(cls, raw: bytes):
+        etag, stamp, body = raw.split(b'\n', 2)
+        group, _, generation = stamp.decode('ascii').partition(':')
+        return cls(etag.decode('ascii'), body, int(group) if group else None, generation or None)
+
+
+def cached_response(etag: str, content, group: int = None) -> CachedResponse:
+    return CachedResponse(etag, orjson.dumps(content), group)
+
+
+class MemoryBackend:
+    """Shared backend interface, kept in process memory"""
+
+    def __init__(self, maxsize: int = ENTITY_CACHE_SIZE):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ENTITY_CACHE_TTL)
+
+    async def get(self, key: str):
+        return self.entries.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self.entries.set(key, value, ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.entries.pop(key)
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        import redis.asyncio
+        self.client = redis.asyncio.from_url(url)
+
+    async def get(self, key: str):
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(key, value, px=int(ttl * 1000))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*keys)
+
+
+def shared_backend(url: str):
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported ENTITY_CACHE_URL {url!r}")
+
+
+class EntityCache:
+    """
+    Entries of one kind of entity, loaded at most once at a time per key:
+    concurrent misses wait for the load already running instead of all
+    querying the database.
+    """
+
+    def __init__(self, namespace: str, shared=None):
+        self.namespace = namespace
+        self.shared = shared
+        self.local = TTLCache(
+            maxsize=ENTITY_CACHE_SIZE,
+            ttl=ENTITY_CACHE_TTL if shared is None else min(ENTITY_CACHE_TTL, ENTITY_CACHE_LOCAL_TTL),
+        )
+        self.loading = {}
+        # Keys invalidated and groups bumped lately, a replica may still return what they held before the write
+        self.recent = TTLCache(maxsize=ENTITY_CACHE_SIZE, ttl=REPLICA_PIN_SECONDS)
+        self.recent_groups = TTLCache(maxsize=ENTITY_CACHE_SIZE, ttl=REPLICA_PIN_SECONDS)
+        # Generation of the groups bumped lately, kept as long as the local
+        # entries: a group missing here had no bump that could outlive them
+        self.generations = TTLCache(maxsize=ENTITY_CACHE_SIZE, ttl=self.local.ttl)
+        # Bumps so far, an entry loaded while one happened may predate it
+        self.bumps = 0
+
+    def _key(self, key) -> str:
+        return f'{self.namespace}:{key}'
+
+    def _generation_key(self, group) -> str:
+        return f'{self.namespace}:generation:{group}'
+
+    async def generation(self, group) -> str:
+        """Current generation of a group, read from the shared backend when it is not known here"""
+        generation = self.generations.get(group)
+        if generation is not None:
+            return generation
+        if self.shared is None:
+            # Only bumped groups are kept without a shared backend, reads do not push them out
+            return '0'
+        generation = '0'
+        try:
+            raw = await self.shared.get(self._generation_key(group))
+            if raw is not None:
+                generation = raw.decode('ascii')
+        except Exception:
+            logger.exception("Reading %s from the shared cache failed", self._generation_key(group))
+        self.generations.set(group, generation)
+        return generation
+
+    async def _current(self, entry: CachedResponse) -> bool:
+        return entry.group is None or entry.generation == await self.generation(entry.group)
+
+    async def _stamp(self, entry: CachedResponse) -> CachedResponse:
+        if entry is None or entry.group is None:
+            return entry
+        return entry._replace(generation=await self.generation(entry.group))
+
+    def _storable(self, key, entry: CachedResponse, bumps: int) -> bool:
+        return (
+            entry is not None and self.recent.get(key) is None and bumps == self.bumps
+            and (entry.group is None or self.recent_groups.get(entry.group) is None)
+        )
+
+    async def _local(self, key):
+        entry = self.local.get(key)
+        if entry is not None and not await self._current(entry):
+            self.local.pop(key)
+            return None
+        return entry
+
+    async def get_or_load(self, key, loader):
+        """Return the cached entry for key, or the CachedResponse (or None) `await loader()` makes"""
+        entry = await self._local(key)
+        if entry is not None:
+            return entry
+        future = self.loading.get(key)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The request loading it went away, load it here instead
+                return await self.get_or_load(key, loader)
+
+        future = self.loading[key] = asyncio.get_running_loop().create_future()
+        bumps = self.bumps
+        try:
+            entry, from_shared = await self._load(key, loader)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # Whoever waits on the future gets the error too, it is not left unretrieved
+            future.exception()
+            raise
+        finally:
+            # Invalidated while loading when the future is gone, the entry may predate the write
+            current = self.loading.get(key) is future
+            if current:
+                del self.loading[key]
+        future.set_result(entry)
+        if current and self._storable(key, entry, bumps):
+            self.local.set(key, entry)
+            if not from_shared:
+                await self._share(key, entry)
+        return entry
+
+    async def get_many(self, keys: list, loader) -> dict:
+        """
+        Entries of several keys. The ones missing here are loaded together by
+        `await loader(missing)`, which returns {key: CachedResponse}, the shared
+        backend is not read for them.
+        """
+        entries, missing = {}, []
+        for key in keys:
+            entry = await self._local(key)
+            if entry is not None:
+                entries[key] = entry
+            else:
+                missing.append(key)
+        if not missing:
+            return entries
+
+        # Registered like single loads, so an invalidation meanwhile keeps the result out of the cache
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in missing if key not in self.loading}
+        self.loading.update(futures)
+        bumps = self.bumps
+        try:
+            loaded = await loader(missing)
+        except BaseException:
+            for key, future in futures.items():
+                if self.loading.get(key) is future:
+                    del self.loading[key]
+                # Single loads waiting on it load the key themselves
+                future.cancel()
+            raise
+
+        stored = []
+        for key in missing:
+            entry = entries[key] = await self._stamp(loaded.get(key))
+            future = futures.get(key)
+            if future is None:
+                continue
+            current = self.loading.get(key) is future
+            if current:
+                del self.loading[key]
+            future.set_result(entry)
+            if current and self._storable(key, entry, bumps):
+                self.local.set(key, entry)
+                stored.append(self._share(key, entry))
+        await asyncio.gather(*stored)
+        return entries
+
+    async def _load(self, key, loader) -> tuple:
+        if self.shared is not None:
+            try:
+                raw = await self.shared.get(self._key(key))
+                if raw is not None:
+                    entry = CachedResponse.decode(raw)
+                    if await self._current(entry):
+                        return entry, True
+            except Exception:
+                logger.exception("Reading %s from the shared cache failed", self._key(key))
+        return await self._stamp(await loader()), False
+
+    async def _share(self, key, entry: CachedResponse):
+        if self.shared is None:
+            return
+        try:
+            await self.shared.set(self._key(key), entry.encode(), ENTITY_CACHE_TTL)
+        except Exception:
+            logger.exception("Writing %s to the shared cache failed", self._key(key))
+
+    async def invalidate(self, *keys):
+        """Drop entries after the write that changed them has been committed"""
+        for key in keys:
+            self.local.pop(key)
+            self.loading.pop(key, None)
+            if replicas.engines:
+                self.recent.set(key, True)
+        if self.shared is not None and keys:
+            try:
+                await self.shared.delete(*[self._key(key) for key in keys])
+            except Exception:
+                logger.exception("Invalidating %s entries in the shared cache failed", self.namespace)
+
+    async def bump(self, group):
+        """Drop every entry of a group after the write that changed them has been committed"""
+        generation = uuid.uuid4().hex
+        self.generations.set(group, generation)
+        self.bumps += 1
+        if replicas.engines:
+            self.recent_groups.set(group, True)
+        if self.shared is not None:
+            try:
+                await self.shared.set(self._generation_key(group), generation.encode('ascii'), ENTITY_CACHE_TTL)
+            except Exception:
+                logger.exception("Bumping %s in the shared cache failed", self._generation_key(group))
+
+
+shared = shared_backend(ENTITY_CACHE_URL)
+profiles = EntityCache('profile', shared)
+quicks = EntityCache('quick', shared)
@@ -0,0 +1,21 @@
+from hashlib import blake2b
+from typing import Optional
+from fastapi import Response
+
+
+def make_etag(*values) -> str:
+    """Strong ETag for the row versions or values a response is built from"""
+    return '"' + blake2b(repr(values).encode('utf-8'), digest_size=16).hexdigest() + '"'
+
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison, so W/"x" matches "x"
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+def not_modified(etag: str, headers: dict = None) -> Response:
+    return Response(status_code=304, headers={**(headers or {}), 'ETag': etag})
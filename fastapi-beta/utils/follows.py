@@ -0,0 +1,70 @@
+from sqlalchemy import select, update, delete, func
+from models.models import User as UserModel
+from models.models import Followers
+from utils.pagination import encode_cursor, decode_id_cursor
+from utils.dialects import insert_for
+from utils.serializers import PUBLIC_USER_COLUMNS, user_to_dict
+
+async def _change_followers(db, user_ids: list, delta: int):
+    # Single UPDATE so concurrent follows can not lose increments
+    await db.execute(
+        update(UserModel)
+        .where(UserModel.user_id.in_(user_ids))
+        .values(followers=func.coalesce(UserModel.followers, 0) + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def add_follows(db, follower_id: int, user_followed_ids: list) -> set:
+    """Insert follow edges in one statement, returns the followed ids whose edge did not exist yet"""
+    insert = insert_for(db.get_bind())
+    created = set((await db.scalars(
+        insert(Followers)
+        .values([
+            {'follower_id': follower_id, 'user_followed_id': user_followed_id}
+            for user_followed_id in user_followed_ids
+        ])
+        .on_conflict_do_nothing(index_elements=['follower_id', 'user_followed_id'])
+        .returning(Followers.user_followed_id)
+    )).all())
+    if created:
+        await _change_followers(db, list(created), 1)
+    return created
+
+
+async def add_follow(db, follower_id: int, user_followed_id: int) -> bool:
+    """Insert a follow edge, returns False when it already existed"""
+    return bool(await add_follows(db, follower_id, [user_followed_id]))
+
+
+async def remove_follow(db, follower_id: int, user_followed_id: int) -> bool:
+    """Delete a follow edge, returns False when there was none"""
+    removed = (await db.execute(
+        delete(Followers)
+        .where(Followers.follower_id == follower_id, Followers.user_followed_id == user_followed_id)
+        .returning(Followers.follow_id)
+    )).first()
+    if removed is None:
+        return False
+    await _change_followers(db, [user_followed_id], -1)
+    return True
+
+
+async def list_follows(db, user_column, owner_column, owner_id: int, after: str, limit: int):
+    """
+    Return one page of the users joined through Followers.user_column for
+    the edges whose owner_column is owner_id, ordered by follow_id, and the
+    cursor of the next page (None on the last one)
+    """
+    query = (
+        select(Followers.follow_id, *PUBLIC_USER_COLUMNS)
+        .join(UserModel, UserModel.user_id == user_column)
+        .where(owner_column == owner_id)
+    )
+    if after:
+        query = query.where(Followers.follow_id > decode_id_cursor(after))
+    rows = (await db.execute(query.order_by(Followers.follow_id).limit(limit))).all()
+
+    users = [user_to_dict(row) for row in rows]
+    next_cursor = encode_cursor(rows[-1].follow_id) if len(rows) == limit else None
+    return users, next_cursor
@@ -11,4 +11,15 @@ def validate_token(token: str) -> dict:
     data: dict = decode(token, key="my_secret_key", algorithms=['HS256'])
     return data
 
-    
+def request_token(headers) -> str:
+    """Token of the auth or Authorization: Bearer header, not validated, None without one"""
+    token = headers.get('auth')
+    if token is None:
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return None
+    return token
+
+def warm_up():
+    """Sign and check a throwaway token so PyJWT loads its algorithms before the first login"""
+    validate_token(create_token({}))
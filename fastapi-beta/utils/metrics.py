@@ -0,0 +1,107 @@
+"""
+Metrics in the Prometheus text exposition format
+
+Kept dependency free and cheap to record: a sample is a dict lookup and an
+addition, histograms add a bisect over their buckets.
+"""
+from bisect import bisect_left
+
+# Upper bounds in seconds of the request latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    """A value that only goes up, or one read from `function` on every scrape"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.function = function
+        self.values = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        if self.function is not None:
+            value = self.function()
+            if value is None:
+                return
+            self.values[()] = value
+        for labels, value in self.values.items():
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+class Gauge(Counter):
+    """A value that goes up and down"""
+
+    kind = 'gauge'
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, value: float, labels: tuple = ()):
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self.values = {}
+
+    def observe(self, value: float, labels: tuple = ()):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
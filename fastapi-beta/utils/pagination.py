@@ -0,0 +1,54 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(*values) -> str:
+    """Pack the sort key of the last row of a page into an opaque token"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list):
+            raise ValueError
+        return values
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def decode_quick_cursor(cursor: str):
+    """Return the (created_at, quick_id) pair encoded in a feed cursor"""
+    values = decode_cursor(cursor)
+    try:
+        created_at, quick_id = values
+        return datetime.fromisoformat(created_at), int(quick_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def decode_id_cursor(cursor: str) -> int:
+    """Return the id encoded in a listing cursor"""
+    values = decode_cursor(cursor)
+    try:
+        (last_id,) = values
+        return int(last_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def decode_search_cursor(cursor: str):
+    """Return the (score, quick_id) pair encoded in a search cursor"""
+    values = decode_cursor(cursor)
+    try:
+        score, quick_id = values
+        return float(score), int(quick_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,273 @@
+"""
+Time partitions of quicks
+
+On Postgres "Quick" is range partitioned by created_at, one partition per
+month named Quick_yYYYYmMM, plus Quick_default for rows outside every month
+(quicks posted with a created_at far in the past or future). SQLite has no
+partitioning: "Quick" holds the months in use and cold months are moved out
+to a table per month with the same names.
+
+Feeds only show quicks created after the horizon, the start of the month
+QUICK_RETENTION_MONTHS before the current one, so Postgres skips the older
+partitions. The maintenance command, meant to run daily:
+
+    - creates the partitions of the next QUICK_PARTITIONS_AHEAD months
+    - moves the months before the horizon out of "Quick" into archive
+      tables (Postgres detaches their partition) and drops the timeline
+      entries older than the horizon
+    - with --export, writes every archive table to a gzip compressed NDJSON
+      file in that directory and drops it
+
+Archive tables have no foreign key to "Users" and are indexed by author_id,
+account deletion removes the user's quicks from them. Exported files are
+outside its reach.
+
+    python -m utils.partitions
+    python -m utils.partitions --retention-months 6 --export /var/backups/quicks
+"""
+import os
+import re
+import gzip
+import json
+import argparse
+import orjson
+from datetime import datetime
+from sqlalchemy import DateTime, bindparam, event, inspect, text
+from models.models import Quick as QuickModel
+
+# Months of quicks kept in "Quick" and shown in feeds, 0 keeps every quick
+QUICK_RETENTION_MONTHS = int(os.environ.get('QUICK_RETENTION_MONTHS', 12))
+# Months after the current one that get their partition ahead of time
+QUICK_PARTITIONS_AHEAD = int(os.environ.get('QUICK_PARTITIONS_AHEAD', 3))
+
+DEFAULT_PARTITION = 'Quick_default'
+PERIOD_NAME = re.compile(r'^Quick_y(\d{4})m(\d{2})$')
+# Columns copied to archives, the search columns are rebuilt from content
+COLUMNS = ', '.join(f'"{column.name}"' for column in QuickModel.__table__.columns)
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def period_name(month: datetime) -> str:
+    return f'Quick_y{month.year:04d}m{month.month:02d}'
+
+
+def period_month(name: str):
+    """The month of a partition or archive table name, None for any other table"""
+    match = PERIOD_NAME.match(name)
+    return datetime(int(match[1]), int(match[2]), 1) if match else None
+
+
+def feed_horizon(retention_months: int = QUICK_RETENTION_MONTHS, now: datetime = None):
+    """Quicks created before this are left out of feeds, None when every quick is kept"""
+    if not retention_months:
+        return None
+    return add_months(month_start(now or datetime.now()), -retention_months)
+
+
+def _period(sql: str, month: datetime):
+    # Typed, so SQLite compares created_at with its own datetime format
+    return text(sql).bindparams(
+        bindparam('start', month, type_=DateTime),
+        bindparam('end', add_months(month, 1), type_=DateTime),
+    )
+
+
+def attached_partitions(conn) -> set:
+    """Postgres only: the partitions of "Quick" """
+    return set(conn.scalars(text('''
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = '"Quick"'::regclass
+    ''')))
+
+
+def create_partition(conn, month: datetime, default_exists: bool = True):
+    """Postgres only: add the partition of a month, moving its rows out of the default partition first"""
+    moved = default_exists and conn.scalar(_period(
+        f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE created_at >= :start AND created_at < :end)', month
+    ))
+    if moved:
+        conn.execute(text(f'CREATE TEMP TABLE quick_moved AS SELECT {COLUMNS} FROM "Quick" WITH NO DATA'))
+        conn.execute(_period(f'''
+            WITH moved AS (
+                DELETE FROM "{DEFAULT_PARTITION}" WHERE created_at >= :start AND created_at < :end
+                RETURNING {COLUMNS}
+            )
+            INSERT INTO quick_moved SELECT * FROM moved
+        ''', month))
+    # Partition bounds are part of the DDL, they can not be bound parameters
+    conn.execute(text(
+        f'''CREATE TABLE "{period_name(month)}" PARTITION OF "Quick" '''
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    ))
+    if moved:
+        conn.execute(text(f'INSERT INTO "Quick" ({COLUMNS}) SELECT {COLUMNS} FROM quick_moved'))
+        conn.execute(text('DROP TABLE quick_moved'))
+
+
+def ensure_partitions(conn, ahead: int = QUICK_PARTITIONS_AHEAD, now: datetime = None) -> list:
+    """Postgres only: create the default partition and those of this month and the next ones, returns the new ones"""
+    attached = attached_partitions(conn)
+    created = []
+    if DEFAULT_PARTITION not in attached:
+        conn.execute(text(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "Quick" DEFAULT'))
+        created.append(DEFAULT_PARTITION)
+    current = month_start(now or datetime.now())
+    for month in (add_months(current, offset) for offset in range(ahead + 1)):
+        if period_name(month) not in attached:
+            create_partition(conn, month, default_exists=DEFAULT_PARTITION in attached)
+            created.append(period_name(month))
+    return created
+
+
+def cold_periods(conn, horizon: datetime) -> list:
+    """Months still in "Quick" that end before the horizon"""
+    if conn.dialect.name == 'postgresql':
+        months = filter(None, map(period_month, attached_partitions(conn)))
+        return sorted(month for month in months if add_months(month, 1) <= horizon)
+    months = conn.scalars(
+        text('SELECT DISTINCT substr(created_at, 1, 7) FROM "Quick" WHERE created_at < :horizon')
+        .bindparams(bindparam('horizon', horizon, type_=DateTime))
+    )
+    return sorted(datetime.strptime(month, '%Y-%m') for month in months if month)
+
+
+def prepare_archive(conn, name: str):
+    """
+    Let account deletion clear an archive table: Postgres keeps the foreign
+    key to "Users" of a detached partition, which would block deleting its
+    authors, and SQLite archive tables start without any index
+    """
+    if conn.dialect.name == 'postgresql':
+        foreign_keys = conn.scalars(
+            text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:name AS regclass) AND contype = 'f'")
+            .bindparams(name=f'"{name}"')
+        ).all()
+        for foreign_key in foreign_keys:
+            conn.execute(text(f'ALTER TABLE "{name}" DROP CONSTRAINT "{foreign_key}"'))
+        return
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS "ix_{name.lower()}_author" ON "{name}" (author_id)'))
+
+
+def archive_period(conn, month: datetime):
+    """Move a month out of "Quick" into its archive table"""
+    name = period_name(month)
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(f'ALTER TABLE "Quick" DETACH PARTITION "{name}"'))
+    else:
+        # The table may be there already when late quicks of an archived month are moved
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{name}" AS SELECT {COLUMNS} FROM "Quick" WHERE 0'))
+        conn.execute(_period(
+            f'INSERT INTO "{name}" SELECT {COLUMNS} FROM "Quick" WHERE created_at >= :start AND created_at < :end', month
+        ))
+        conn.execute(_period('DELETE FROM "Quick" WHERE created_at >= :start AND created_at < :end', month))
+    prepare_archive(conn, name)
+
+
+def prune_timelines(conn, horizon: datetime) -> int:
+    """Drop the timeline entries of quicks created before the horizon"""
+    result = conn.execute(
+        text('DELETE FROM "Timeline" WHERE created_at < :horizon')
+        .bindparams(bindparam('horizon', horizon, type_=DateTime))
+    )
+    return max(result.rowcount, 0)
+
+
+def archive_tables(conn) -> list:
+    """Archive tables of past months, the period tables that are not a partition of "Quick" """
+    attached = attached_partitions(conn) if conn.dialect.name == 'postgresql' else set()
+    return sorted(
+        name for name in inspect(conn).get_table_names()
+        if period_month(name) and name not in attached
+    )
+
+
+def delete_archived_quicks(conn, user_id: int) -> int:
+    """Delete the quicks of a user from every archive table, returns how many"""
+    deleted = 0
+    for name in archive_tables(conn):
+        result = conn.execute(text(f'DELETE FROM "{name}" WHERE author_id = :user_id').bindparams(user_id=user_id))
+        deleted += max(result.rowcount, 0)
+    return deleted
+
+
+def export_archive(conn, name: str, directory: str) -> str:
+    """Write an archive table to a gzip compressed NDJSON file in directory and drop it, returns the file path"""
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, name.lower())
+    path, copy = f'{base}.ndjson.gz', 0
+    # Late quicks of a month already exported go to a file of their own
+    while os.path.exists(path):
+        copy += 1
+        path = f'{base}.{copy}.ndjson.gz'
+    rows = conn.execution_options(stream_results=True).execute(
+        text(f'SELECT {COLUMNS} FROM "{name}" ORDER BY quick_id')
+    )
+    with gzip.open(f'{path}.tmp', 'wb') as file:
+        for row in rows.mappings():
+            file.write(orjson.dumps(dict(row)) + b'\n')
+    os.replace(f'{path}.tmp', path)
+    conn.execute(text(f'DROP TABLE "{name}"'))
+    return path
+
+
+def maintain(engine, retention_months: int, ahead: int, export: str = None) -> dict:
+    """Run every maintenance step, one transaction per partition or archive"""
+    report = {'created': [], 'archived': [], 'timeline_entries_pruned': 0, 'exported': []}
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            report['created'] = ensure_partitions(conn, ahead)
+
+    horizon = feed_horizon(retention_months)
+    if horizon:
+        with engine.connect() as conn:
+            months = cold_periods(conn, horizon)
+        for month in months:
+            # Committed one by one, Postgres locks "Quick" while it detaches a partition
+            with engine.begin() as conn:
+                archive_period(conn, month)
+            report['archived'].append(period_name(month))
+        with engine.begin() as conn:
+            report['timeline_entries_pruned'] = prune_timelines(conn, horizon)
+
+    # Idempotent, so archive tables left by earlier runs get it as well
+    with engine.begin() as conn:
+        for name in archive_tables(conn):
+            prepare_archive(conn, name)
+
+    if export:
+        with engine.connect() as conn:
+            names = archive_tables(conn)
+        for name in names:
+            with engine.begin() as conn:
+                report['exported'].append(export_archive(conn, name, export))
+    return report
+
+
+@event.listens_for(QuickModel.__table__, 'after_create')
+def _create_partitions(target, connection, **kw):
+    # create_all makes the partitioned table, inserts need a partition to land in
+    if connection.dialect.name == 'postgresql':
+        ensure_partitions(connection)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create upcoming partitions of quicks and archive the cold ones")
+    parser.add_argument('--retention-months', type=int, default=QUICK_RETENTION_MONTHS,
+                        help="months kept before the current one, 0 archives nothing")
+    parser.add_argument('--ahead', type=int, default=QUICK_PARTITIONS_AHEAD,
+                        help="months after the current one to create partitions for (Postgres only)")
+    parser.add_argument('--export', metavar='DIRECTORY',
+                        help="write archive tables to compressed files here and drop them")
+    args = parser.parse_args()
+
+    from config.database import engine
+    print(json.dumps(maintain(engine, args.retention_months, args.ahead, args.export)))
@@ -0,0 +1,69 @@
+import os
+import asyncio
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+# bcrypt releases the GIL while hashing, so a thread pool runs hashes in parallel
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', os.cpu_count() or 1))
+# Hashes allowed to wait or run at once before new ones are shed with a 503
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', 32))
+
+executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bcrypt')
+_queue_depth = 0
+
+
+def queue_depth() -> int:
+    return _queue_depth
+
+
+async def _run(func, *args):
+    global _queue_depth
+    if _queue_depth >= HASH_QUEUE_LIMIT:
+        raise HTTPException(status_code=503, detail="Server busy, try again later", headers={'Retry-After': '1'})
+    _queue_depth += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    finally:
+        _queue_depth -= 1
+
+
+def _stored_hash(stored: str) -> bytes:
+    # Old rows hold the hash bytes as psycopg2 wrote them: '\x' followed by hex
+    if stored.startswith('\\x'):
+        return bytes.fromhex(stored[2:])
+    return stored.encode('ascii')
+
+
+def hash_password_sync(password: str) -> str:
+    """Blocking version of hash_password, for scripts and worker processes"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('ascii')
+
+
+def _verify(password: str, stored: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), _stored_hash(stored))
+    except ValueError:
+        return False
+
+
+async def hash_password(password: str) -> str:
+    """Return the bcrypt hash of a password in its '$2b$<rounds>$...' text form"""
+    return await _run(hash_password_sync, password)
+
+
+async def verify_password(password: str, stored: str) -> bool:
+    if not stored:
+        return False
+    return await _run(_verify, password, stored)
+
+
+def needs_rehash(stored: str) -> bool:
+    """True for hashes in the old hex form or made with a different work factor"""
+    if stored.startswith('\\x'):
+        return True
+    try:
+        return int(stored.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,145 @@
+"""
+Group commit of new quicks
+
+With POST_BUFFER_ENABLED, post hands its quick to this buffer instead of
+committing it alone. A single flusher writes whatever has queued up, at most
+POST_BUFFER_BATCH_SIZE quicks, in one multi-row INSERT and one transaction,
+at the latest POST_BUFFER_MAX_WAIT_MS after the first of them arrived. Each
+request is answered once the transaction holding its quick has committed.
+
+At most POST_BUFFER_CAPACITY quicks wait at once, further posts get a 503
+with Retry-After until the flusher catches up. close() writes what is left.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import NamedTuple
+from fastapi import HTTPException
+from sqlalchemy import insert
+from config.database import AsyncSession, env_flag, replicas
+from models.models import Quick as QuickModel
+from utils import timeline
+from utils.tasks import start_detached
+
+logger = logging.getLogger(__name__)
+
+POST_BUFFER_ENABLED = env_flag('POST_BUFFER_ENABLED', False)
+POST_BUFFER_BATCH_SIZE = int(os.environ.get('POST_BUFFER_BATCH_SIZE', 200))
+POST_BUFFER_MAX_WAIT_MS = float(os.environ.get('POST_BUFFER_MAX_WAIT_MS', 10))
+POST_BUFFER_CAPACITY = int(os.environ.get('POST_BUFFER_CAPACITY', 5000))
+# Rows per multi-VALUES INSERT on SQLite, under its default limit of 999 bound parameters
+SQLITE_INSERT_ROWS = 999 // len(QuickModel.__table__.columns)
+
+
+async def _insert_sqlite(db, rows: list) -> list:
+    # SQLAlchemy sends one INSERT per row when it can not trust SQLite to
+    # return the rows in order. A multi-VALUES INSERT on an AUTOINCREMENT
+    # table hands out ascending ids in the order of its VALUES, so the ids
+    # it returns, sorted, are those of the rows
+    quick_ids = []
+    for start in range(0, len(rows), SQLITE_INSERT_ROWS):
+        returned = await db.scalars(
+            insert(QuickModel).values(rows[start:start + SQLITE_INSERT_ROWS]).returning(QuickModel.quick_id)
+        )
+        quick_ids.extend(sorted(returned))
+    return quick_ids
+
+
+async def insert_quicks(db, rows: list) -> list:
+    """Insert quicks and push them into their followers' timelines, returns their ids in the order of rows"""
+    if db.bind.dialect.name == 'sqlite':
+        quick_ids = await _insert_sqlite(db, rows)
+    else:
+        quick_ids = (await db.scalars(
+            insert(QuickModel).returning(QuickModel.quick_id, sort_by_parameter_order=True), rows
+        )).all()
+    await timeline.fan_out_quicks(db, quick_ids, list({row['author_id'] for row in rows}))
+    return quick_ids
+
+
+class PendingQuick(NamedTuple):
+    row: dict             # Quick columns, without quick_id
+    principal: str        # token of the request, pinned to the primary once written
+    written: asyncio.Future
+
+
+class PostBuffer:
+    def __init__(self, batch_size: int, max_wait: float, capacity: int):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.capacity = capacity
+        self.queue = None
+        self.flusher = None
+        self.closing = False
+
+    async def submit(self, row: dict, principal: str = None) -> dict:
+        """Queue a quick, returns its row with quick_id once it is committed"""
+        if self.closing:
+            raise HTTPException(status_code=503, detail="Server shutting down, try again later", headers={'Retry-After': '1'})
+        if self.flusher is None:
+            # Made on first use, inside the loop that serves the requests
+            self.queue = asyncio.Queue(self.capacity)
+            self.flusher = start_detached(self._run())
+        pending = PendingQuick(row, principal, asyncio.get_running_loop().create_future())
+        try:
+            self.queue.put_nowait(pending)
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="Server busy, try again later", headers={'Retry-After': '1'})
+        # Shielded: a client that goes away does not take its quick out of the batch
+        return await asyncio.shield(pending.written)
+
+    async def _next_batch(self) -> list:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._flush(batch)
+            except Exception:
+                logger.exception("Writing a batch of %s quicks failed, writing them one by one", len(batch))
+                for pending in batch:
+                    try:
+                        await self._flush([pending])
+                    except Exception as error:
+                        if not pending.written.done():
+                            pending.written.set_exception(error)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _flush(self, batch: list):
+        rows = [pending.row for pending in batch]
+        async with AsyncSession() as db:
+            quick_ids = await insert_quicks(db, rows)
+            await db.commit()
+        for pending, quick_id in zip(batch, quick_ids):
+            if pending.principal and replicas.engines:
+                replicas.pin(pending.principal)
+            if not pending.written.done():
+                pending.written.set_result(dict(pending.row, quick_id=quick_id))
+
+    async def close(self):
+        """Stop taking quicks and write the ones already queued"""
+        self.closing = True
+        if self.flusher is not None:
+            await self.queue.join()
+            self.flusher.cancel()
+            self.flusher = None
+
+
+buffer = PostBuffer(POST_BUFFER_BATCH_SIZE, POST_BUFFER_MAX_WAIT_MS / 1000, POST_BUFFER_CAPACITY)
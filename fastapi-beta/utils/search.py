@@ -0,0 +1,78 @@
+import re
+from sqlalchemy import DDL, event, select, or_, and_, func, literal_column, table, column
+from models.models import Quick as QuickModel
+from utils.serializers import select_quicks
+
+# Content of quicks deleted by their author, they stay in feeds but not in search results
+DELETED_CONTENT = 'Quick deleted'
+
+# Postgres keeps a generated tsvector column, SQLite an FTS5 table whose
+# triggers follow every insert, update and delete on "Quick"
+POSTGRES_DDL = (
+    '''ALTER TABLE "Quick" ADD COLUMN IF NOT EXISTS search_vector tsvector
+       GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED''',
+    'CREATE INDEX IF NOT EXISTS ix_quick_search ON "Quick" USING GIN (search_vector)',
+)
+SQLITE_DDL = (
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS quick_search
+       USING fts5(content, content='Quick', content_rowid='quick_id')''',
+    '''CREATE TRIGGER IF NOT EXISTS quick_search_insert AFTER INSERT ON "Quick" BEGIN
+           INSERT INTO quick_search (rowid, content) VALUES (new.quick_id, new.content);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS quick_search_delete AFTER DELETE ON "Quick" BEGIN
+           INSERT INTO quick_search (quick_search, rowid, content) VALUES ('delete', old.quick_id, old.content);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS quick_search_update AFTER UPDATE OF content ON "Quick" BEGIN
+           INSERT INTO quick_search (quick_search, rowid, content) VALUES ('delete', old.quick_id, old.content);
+           INSERT INTO quick_search (rowid, content) VALUES (new.quick_id, new.content);
+       END''',
+)
+
+for statement in POSTGRES_DDL:
+    event.listen(QuickModel.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE_DDL:
+    event.listen(QuickModel.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+fts = table('quick_search', column('rowid'))
+
+
+def _fts_query(terms: str) -> str:
+    # Every word quoted, so user input can not break the FTS5 query syntax
+    return ' '.join(f'"{word}"' for word in re.findall(r'\w+', terms))
+
+
+def search_query(dialect: str, terms: str, after: tuple = None, limit: int = 50):
+    """
+    Quicks matching terms, best match first, with a `score` column. `after`
+    is the (score, quick_id) of the last row of the previous page.
+    Returns None when terms has nothing to search for.
+    """
+    if dialect == 'postgresql':
+        query = func.websearch_to_tsquery(literal_column("'simple'::regconfig"), terms)
+        vector = literal_column('"Quick".search_vector')
+        score = func.ts_rank(vector, query)
+        matches = (
+            select_quicks(score.label('score'))
+            .where(vector.op('@@')(query))
+        )
+    else:
+        match = _fts_query(terms)
+        if not match:
+            return None
+        # bm25() is lower for better matches
+        score = -func.bm25(literal_column('quick_search'))
+        matches = (
+            select_quicks(score.label('score'))
+            .join(fts, fts.c.rowid == QuickModel.quick_id)
+            .where(literal_column('quick_search').op('MATCH')(match))
+        )
+    ranked = matches.where(QuickModel.content != DELETED_CONTENT).subquery()
+
+    query = select(ranked)
+    if after:
+        last_score, last_id = after
+        query = query.where(or_(
+            ranked.c.score < last_score,
+            and_(ranked.c.score == last_score, ranked.c.quick_id < last_id),
+        ))
+    return query.order_by(ranked.c.score.desc(), ranked.c.quick_id.desc()).limit(limit)
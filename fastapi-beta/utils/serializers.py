@@ -0,0 +1,73 @@
+from sqlalchemy import select, func
+from models.models import User as UserModel
+from models.models import Quick as QuickModel
+
+# Responses are rendered with orjson, which writes datetimes as ISO 8601
+# itself, so rows are turned into plain dicts without encoding values first
+
+QUICK_COLUMNS = (
+    QuickModel.quick_id,
+    QuickModel.content,
+    QuickModel.created_at,
+    QuickModel.updated_at,
+    # The current nick name of the author, "by" only for quicks that predate author_id
+    func.coalesce(UserModel.nick_name, QuickModel.by).label('by'),
+)
+
+
+
+def select_quicks(*columns):
+    """SELECT of QUICK_COLUMNS (plus columns) joined to the author"""
+    return select(*QUICK_COLUMNS, *columns).outerjoin(UserModel, UserModel.user_id == QuickModel.author_id)
+
+
+# Columns of Users that can be shown to other users
+PUBLIC_USER_COLUMNS = (
+    UserModel.user_id,
+    UserModel.email,
+    UserModel.nick_name,
+    UserModel.first_name,
+    UserModel.last_name,
+    UserModel.birth_date,
+    UserModel.followers,
+)
+
+
+def quick_to_dict(row) -> dict:
+    return {
+        'quick_id': row.quick_id,
+        'content': row.content,
+        'created_at': row.created_at,
+        'updated_at': row.updated_at,
+        'by': row.by,
+    }
+
+
+def feed_item(row) -> dict:
+    """A quick as shown in the feed, created_at as 'YYYY-MM-DD HH:MM:SS'"""
+    return {
+        'quick_id': row.quick_id,
+        'content': row.content,
+        'created_at': row.created_at.isoformat(' ', 'seconds') if row.created_at else None,
+        'updated_at': row.updated_at,
+        'by': row.by,
+    }
+
+
+def user_to_dict(row) -> dict:
+    return {
+        'user_id': row.user_id,
+        'email': row.email,
+        'nick_name': row.nick_name,
+        'first_name': row.first_name,
+        'last_name': row.last_name,
+        'birth_date': row.birth_date,
+        'followers': row.followers,
+    }
+
+
+def profile_to_dict(row) -> dict:
+    """A user as shown in their profile, birth_date as 'YYYY-MM-DD'"""
+    user = user_to_dict(row)
+    user['birth_date'] = row.birth_date.date().isoformat() if row.birth_date else None
+    return user
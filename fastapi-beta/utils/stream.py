@@ -0,0 +1,224 @@
+"""
+Live feed push
+
+Connected users get the quicks of the users they follow as they are posted.
+Every worker keeps its own connections and, for them, who follows whom;
+new quicks and follow changes go through a broker so that every worker
+hears about them:
+
+    STREAM_BROKER_URL=memory://                 single process (default)
+    STREAM_BROKER_URL=redis://localhost:6379/0  several workers, needs the redis package
+
+Each connection has a queue of STREAM_QUEUE_SIZE events. A consumer that
+falls behind loses its oldest events and is told how many with a
+{"type": "lagged"} event, so publishing never waits on a slow client.
+"""
+import os
+import asyncio
+import logging
+import orjson
+from fastapi import HTTPException
+from sqlalchemy import select
+from config.database import AsyncSession
+from models.models import Followers
+from middlewares.jwt_bearer import resolve_principal
+from utils.metrics import registry, Gauge
+
+logger = logging.getLogger(__name__)
+
+STREAM_BROKER_URL = os.environ.get('STREAM_BROKER_URL')
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 100))
+# Seconds between keep-alive comments on idle event streams
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15))
+
+
+class InProcessBroker:
+    """Broker interface: start(handler), publish(message) and stop()"""
+
+    def __init__(self):
+        self.handler = None
+
+    async def start(self, handler):
+        self.handler = handler
+
+    async def publish(self, message: dict):
+        self.handler(message)
+
+    async def stop(self):
+        self.handler = None
+
+
+class RedisBroker:
+    CHANNEL = 'quicker:stream'
+
+    def __init__(self, url: str):
+        import redis.asyncio
+        self.client = redis.asyncio.from_url(url)
+        self.pubsub = None
+        self.task = None
+
+    async def start(self, handler):
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.subscribe(self.CHANNEL)
+        self.task = asyncio.create_task(self._listen(handler))
+
+    async def _listen(self, handler):
+        async for message in self.pubsub.listen():
+            if message['type'] == 'message':
+                try:
+                    handler(orjson.loads(message['data']))
+                except Exception:
+                    logger.exception("Handling a stream message failed")
+
+    async def publish(self, message: dict):
+        await self.client.publish(self.CHANNEL, orjson.dumps(message))
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        if self.pubsub:
+            await self.pubsub.close()
+
+
+def broker_from_url(url: str):
+    if not url or url.startswith('memory://'):
+        return InProcessBroker()
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported STREAM_BROKER_URL {url!r}")
+
+
+class Subscription:
+    def __init__(self, user_id: int, maxsize: int = STREAM_QUEUE_SIZE):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def push(self, data: bytes):
+        if self.queue.full():
+            # Backpressure: drop the oldest event rather than block the publisher
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+
+    async def next(self, timeout: float = None):
+        """The next encoded event, None when timeout passes without one"""
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            return orjson.dumps({'type': 'lagged', 'dropped': dropped})
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Hub:
+    def __init__(self, broker):
+        self.broker = broker
+        self.started = False
+        # user_id -> open subscriptions of that user on this worker
+        self.subscriptions = {}
+        # For connected users only: who they follow, and the reverse
+        self.follows = {}
+        self.audience = {}
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self.subscriptions.values())
+
+    async def start(self):
+        if not self.started:
+            self.started = True
+            await self.broker.start(self.handle)
+
+    async def stop(self):
+        if self.started:
+            self.started = False
+            await self.broker.stop()
+
+    async def connect(self, user_id: int, followed_ids) -> Subscription:
+        await self.start()
+        subscription = Subscription(user_id)
+        if user_id not in self.subscriptions:
+            self.subscriptions[user_id] = set()
+            self.follows[user_id] = set()
+            for followed_id in followed_ids:
+                self._follow(user_id, followed_id)
+        self.subscriptions[user_id].add(subscription)
+        return subscription
+
+    def disconnect(self, subscription: Subscription):
+        user_id = subscription.user_id
+        subscriptions = self.subscriptions.get(user_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self.subscriptions[user_id]
+            for followed_id in self.follows.pop(user_id, ()):
+                audience = self.audience.get(followed_id)
+                audience.discard(user_id)
+                if not audience:
+                    del self.audience[followed_id]
+
+    def _follow(self, user_id: int, followed_id: int):
+        self.follows[user_id].add(followed_id)
+        self.audience.setdefault(followed_id, set()).add(user_id)
+
+    def _unfollow(self, user_id: int, followed_id: int):
+        self.follows[user_id].discard(followed_id)
+        audience = self.audience.get(followed_id)
+        if audience is not None:
+            audience.discard(user_id)
+            if not audience:
+                del self.audience[followed_id]
+
+    async def publish_quick(self, author_id: int, quick: dict):
+        """Send a committed quick to the connected followers of its author"""
+        await self.start()
+        await self.broker.publish({'type': 'quick', 'author_id': author_id, 'quick': quick})
+
+    async def followed(self, user_id: int, followed_id: int):
+        await self.start()
+        await self.broker.publish({'type': 'follow', 'user_id': user_id, 'followed_id': followed_id})
+
+    async def unfollowed(self, user_id: int, followed_id: int):
+        await self.start()
+        await self.broker.publish({'type': 'unfollow', 'user_id': user_id, 'followed_id': followed_id})
+
+    def handle(self, message: dict):
+        kind = message['type']
+        if kind == 'quick':
+            audience = self.audience.get(message['author_id'])
+            if audience:
+                data = orjson.dumps({'type': 'quick', 'quick': message['quick']})
+                for user_id in audience:
+                    for subscription in self.subscriptions[user_id]:
+                        subscription.push(data)
+        elif message['user_id'] in self.subscriptions:
+            if kind == 'follow':
+                self._follow(message['user_id'], message['followed_id'])
+            elif kind == 'unfollow':
+                self._unfollow(message['user_id'], message['followed_id'])
+
+
+hub = Hub(broker_from_url(STREAM_BROKER_URL))
+
+registry.register(Gauge('stream_connections', 'Open live feed connections on this worker',
+                        function=lambda: hub.connections))
+
+
+async def subscribe(token: str):
+    """Open a subscription for the user a token belongs to, None when it does not resolve"""
+    if not token:
+        return None
+    # A short session of its own: the stream outlives any request scoped one
+    async with AsyncSession() as db:
+        try:
+            principal = await resolve_principal(token, db)
+        except HTTPException:
+            return None
+        followed_ids = (await db.scalars(
+            select(Followers.user_followed_id).where(Followers.follower_id == principal.user_id)
+        )).all()
+    return await hub.connect(principal.user_id, followed_ids)
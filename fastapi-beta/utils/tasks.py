@@ -0,0 +1,17 @@
+import asyncio
+import contextvars
+
+# The loop only keeps weak references to tasks, these stay alive until they finish
+_running = set()
+
+
+def start_detached(coro) -> asyncio.Task:
+    """
+    Run coro as a task of its own, in an empty context: a task copies the
+    context it is created in, so one started by a request would otherwise
+    carry that request's context variables (SQL timing stats) for its lifetime.
+    """
+    task = contextvars.Context().run(asyncio.create_task, coro)
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
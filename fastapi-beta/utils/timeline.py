@@ -0,0 +1,190 @@
+"""
+Home timelines, one row per quick shown to a user
+
+Posting only inserts into the timelines of the author's followers. The
+entries past the TIMELINE_MAX_LENGTH newest of each timeline are dropped
+afterwards by `trimmer`, every TIMELINE_TRIM_INTERVAL seconds, so a post
+does not pay for walking the timeline of every follower.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import select, insert, update, delete, literal, func, tuple_, bindparam
+from config.database import AsyncSession
+from models.models import User as UserModel
+from models.models import Quick as QuickModel
+from models.models import Followers
+from models.models import Timeline
+from utils.tasks import start_detached
+
+logger = logging.getLogger(__name__)
+
+# Max number of entries kept in each user's home timeline
+TIMELINE_MAX_LENGTH = int(os.environ.get('TIMELINE_MAX_LENGTH', 800))
+# Seconds between two trims of the timelines that got new entries
+TIMELINE_TRIM_INTERVAL = float(os.environ.get('TIMELINE_TRIM_INTERVAL', 30))
+# Timelines trimmed per transaction
+TIMELINE_TRIM_BATCH_SIZE = int(os.environ.get('TIMELINE_TRIM_BATCH_SIZE', 500))
+
+_trim = (
+    delete(Timeline.__table__)
+    .where(
+        Timeline.user_id == bindparam('user'),
+        tuple_(Timeline.created_at, Timeline.quick_id)
+        <= tuple_(bindparam('created_at', type_=Timeline.created_at.type), bindparam('quick_id')),
+    )
+)
+
+
+async def trim(db, user_ids: list) -> int:
+    """
+    Drop every entry after the TIMELINE_MAX_LENGTH newest ones of each
+    timeline. Each timeline is only read up to its first entry past the cap
+    on ix_timeline_user_created, timelines under the cap are left alone.
+    Returns the number of timelines trimmed.
+    """
+    def first_dropped(column):
+        return (
+            select(column)
+            .where(Timeline.user_id == UserModel.user_id)
+            .order_by(Timeline.created_at.desc(), Timeline.quick_id.desc())
+            .offset(TIMELINE_MAX_LENGTH)
+            .limit(1)
+            .correlate(UserModel)
+            .scalar_subquery()
+        )
+
+    cutoffs = (await db.execute(
+        select(UserModel.user_id, first_dropped(Timeline.created_at), first_dropped(Timeline.quick_id))
+        .where(UserModel.user_id.in_(user_ids))
+    )).all()
+    cutoffs = [
+        {'user': user_id, 'created_at': created_at, 'quick_id': quick_id}
+        for user_id, created_at, quick_id in cutoffs if quick_id is not None
+    ]
+    if cutoffs:
+        await db.execute(_trim, cutoffs)
+    return len(cutoffs)
+
+
+class Trimmer:
+    """Trims, in the background, the timelines of the followers of authors that posted"""
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.authors = set()
+        self.task = None
+
+    def grew(self, author_ids):
+        """Called once the quicks of these authors are in their followers' timelines"""
+        self.authors.update(author_ids)
+        if self.task is None:
+            self.task = start_detached(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.trim_pending()
+            except Exception:
+                logger.exception("Trimming timelines failed")
+
+    async def trim_pending(self) -> int:
+        authors, self.authors = self.authors, set()
+        if not authors:
+            return 0
+        trimmed = 0
+        async with AsyncSession() as db:
+            followers = (await db.scalars(
+                select(Followers.follower_id).where(Followers.user_followed_id.in_(authors)).distinct()
+            )).all()
+            # One short transaction per batch, posts are not held up behind the whole trim
+            for start in range(0, len(followers), self.batch_size):
+                trimmed += await trim(db, followers[start:start + self.batch_size])
+                await db.commit()
+        return trimmed
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.trim_pending()
+
+
+trimmer = Trimmer(TIMELINE_TRIM_INTERVAL, TIMELINE_TRIM_BATCH_SIZE)
+
+
+async def fan_out_quick(db, quick: QuickModel, author_id: int):
+    """Push a new quick into the timeline of every follower of its author"""
+    await db.execute(
+        insert(Timeline).from_select(
+            ['user_id', 'quick_id', 'created_at'],
+            select(Followers.follower_id, literal(quick.quick_id), literal(quick.created_at))
+            .where(Followers.user_followed_id == author_id)
+            .distinct()
+        )
+    )
+    trimmer.grew([author_id])
+
+
+async def fan_out_quicks(db, quick_ids: list, author_ids: list):
+    """fan_out_quick for a batch of new quicks, in one insert"""
+    await db.execute(
+        insert(Timeline).from_select(
+            ['user_id', 'quick_id', 'created_at'],
+            select(Followers.follower_id, QuickModel.quick_id, QuickModel.created_at)
+            .join(QuickModel, QuickModel.author_id == Followers.user_followed_id)
+            .where(QuickModel.quick_id.in_(quick_ids))
+            .distinct()
+        )
+    )
+    trimmer.grew(author_ids)
+
+
+async def backfill(db, user_id: int, followed_ids: list):
+    """Copy the latest quicks of newly followed users into a timeline"""
+    latest = (
+        select(literal(user_id), QuickModel.quick_id, QuickModel.created_at)
+        .where(QuickModel.author_id.in_(followed_ids))
+        .order_by(QuickModel.created_at.desc(), QuickModel.quick_id.desc())
+        .limit(TIMELINE_MAX_LENGTH)
+    )
+    await db.execute(insert(Timeline).from_select(['user_id', 'quick_id', 'created_at'], latest))
+    await trim(db, [user_id])
+
+
+async def remove_author(db, user_id: int, followed_id: int):
+    """Remove the quicks of an unfollowed user from a timeline"""
+    await db.execute(
+        delete(Timeline)
+        .where(
+            Timeline.user_id == user_id,
+            Timeline.quick_id.in_(select(QuickModel.quick_id).where(QuickModel.author_id == followed_id))
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def touch(db, author_id: int):
+    """Change the feed version of the followers of an author, when one of their quicks is edited"""
+    await db.execute(update(UserModel).where(UserModel.user_id == author_id).values(updated_at=datetime.now()))
+
+
+async def version(db, user_id: int) -> tuple:
+    """
+    Values that change whenever a user's home timeline can change: the follow
+    set (count and newest edge), the newest entry, and the latest change of a
+    followed user, to their profile (the nick name shown) or one of their quicks
+    """
+    follows = select(func.count(), func.max(Followers.follow_id)).where(Followers.follower_id == user_id).subquery()
+    row = (await db.execute(select(
+        follows,
+        select(func.max(Timeline.quick_id)).where(Timeline.user_id == user_id).scalar_subquery(),
+        select(func.max(UserModel.updated_at))
+        .join(Followers, Followers.user_followed_id == UserModel.user_id)
+        .where(Followers.follower_id == user_id)
+        .scalar_subquery(),
+    ))).one()
+    return tuple(row)